@@ -0,0 +1,158 @@
+import asyncio
+import os
+from email.utils import parsedate_to_datetime
+from time import monotonic, time
+
+import breaker
+import http_client
+import logs
+from ratelimit import AIMDLimiter, BucketRegistry
+
+asana_url = os.environ.get("ASANA_URL", "https://app.asana.com").rstrip("/")
+asana_api_url = asana_url + "/api/1.0/"
+oauth_authorize_url = asana_url + "/-/oauth_authorize"
+oauth_token_url = asana_url + "/-/oauth_token"
+page_limit = min(int(os.environ.get("ASANA_PAGE_LIMIT", "100")), 100)  # Asana rejects limit > 100
+
+max_retries = int(os.environ.get("ASANA_MAX_RETRIES", "3"))
+max_retry_after = float(os.environ.get("ASANA_MAX_RETRY_AFTER", "30"))
+token_limits = BucketRegistry(float(os.environ.get("ASANA_TOKEN_RATE", "25")),
+                              int(os.environ.get("ASANA_TOKEN_BURST", "50")))
+workspace_limits = BucketRegistry(float(os.environ.get("ASANA_WORKSPACE_RATE", "100")),
+                                  int(os.environ.get("ASANA_WORKSPACE_BURST", "200")))
+concurrency = AIMDLimiter(
+    initial=int(os.environ.get("ASANA_CONCURRENCY_INITIAL", "20")),
+    minimum=int(os.environ.get("ASANA_CONCURRENCY_MIN", "2")),
+    maximum=int(os.environ.get("ASANA_CONCURRENCY_MAX", "100"))
+)
+
+api_circuit = breaker.register("asana_api", float(os.environ.get("ASANA_API_TIMEOUT", "10")))
+oauth_circuit = breaker.register("asana_oauth", float(os.environ.get("ASANA_OAUTH_TIMEOUT", "10")))
+
+# A 429 pauses every request for the same token or workspace until Retry-After has passed
+_blocked_until: dict = {}
+
+counters = {
+    "requests": 0,
+    "throttled": 0,
+    "retries": 0,
+    "retry_wait_seconds": 0.0
+}
+
+
+class AsanaUnauthorized(Exception):
+    pass
+
+
+def headers(asana_token):
+    return {
+        "accept": "application/json",
+        "authorization": f"Bearer {asana_token}"
+    }
+
+
+def _retry_after(response, attempt) -> float:
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return min(float(value), max_retry_after)
+        except ValueError:
+            try:
+                return min(max(parsedate_to_datetime(value).timestamp() - time(), 0.0), max_retry_after)
+            except (TypeError, ValueError):
+                pass
+    return min(2.0 ** attempt, max_retry_after)
+
+
+async def _wait_if_blocked(keys):
+    now = monotonic()
+    wait = max((_blocked_until.get(key, 0.0) - now for key in keys), default=0.0)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def request(method, path, asana_token=None, workspace_id=None, **kwargs):
+    # path is relative to the API root, or a full URL for the OAuth endpoints
+    oauth = path.startswith(("https://", "http://"))
+    url = path if oauth else asana_api_url + path
+    circuit = oauth_circuit if oauth else api_circuit
+    if asana_token:
+        kwargs['headers'] = {**headers(asana_token), **kwargs.get('headers', {})}
+    keys = [key for key in (("token", asana_token), ("workspace", workspace_id)) if key[1]]
+
+    attempt = 0
+    while True:
+        await _wait_if_blocked(keys)
+        if asana_token:
+            await token_limits.acquire(asana_token)
+        if workspace_id:
+            await workspace_limits.acquire(workspace_id)
+
+        async with concurrency:
+            counters["requests"] += 1
+            response = await circuit.call(http_client.request, method, url, **kwargs)
+
+        if response.status_code != 429:
+            concurrency.on_success()
+            return response
+
+        concurrency.on_throttled()
+        counters["throttled"] += 1
+        if attempt >= max_retries:
+            return response
+        delay = _retry_after(response, attempt)
+        now = monotonic()
+        if len(_blocked_until) > 10000:
+            for expired in [key for key, until in _blocked_until.items() if until <= now]:
+                del _blocked_until[expired]
+        for key in keys:
+            _blocked_until[key] = max(_blocked_until.get(key, 0.0), now + delay)
+        logs.warning("asana.throttled", path=path, retry_after=delay, attempt=attempt,
+                     concurrency_limit=concurrency.limit)
+        counters["retries"] += 1
+        counters["retry_wait_seconds"] += delay
+        attempt += 1
+
+
+async def get(path, asana_token, params=None, workspace_id=None):
+    response = await request("GET", path, asana_token, workspace_id, params=params)
+    if response.status_code == 401:
+        raise AsanaUnauthorized(path)
+    return response
+
+
+async def paginate(path, asana_token, params=None, opt_fields=None, limit=page_limit, offset=None, max_items=None,
+                   workspace_id=None):
+    # Yields items one at a time, fetching the next page only when the previous one is consumed
+    params = dict(params or {}, limit=limit)
+    if opt_fields:
+        params['opt_fields'] = ",".join(opt_fields)
+    if offset:
+        params['offset'] = offset
+
+    yielded = 0
+    while True:
+        response = await get(path, asana_token, params, workspace_id)
+        response.raise_for_status()
+        body = response.json()
+        for item in body['data']:
+            yield item
+            yielded += 1
+            if max_items is not None and yielded >= max_items:
+                return
+        next_page = body.get('next_page')
+        if not next_page:
+            return
+        params['offset'] = next_page['offset']
+
+
+def stats():
+    now = monotonic()
+    return {
+        **counters,
+        "concurrency_limit": round(concurrency.limit, 2),
+        "in_flight": concurrency.in_flight,
+        "blocked_keys": sum(1 for until in _blocked_until.values() if until > now),
+        "token_buckets": len(token_limits),
+        "workspace_buckets": len(workspace_limits)
+    }
@@ -0,0 +1,212 @@
+import asyncio
+import os
+from collections import OrderedDict
+from time import monotonic
+
+import asana_client
+import logs
+import shared_cache
+from breaker import CircuitOpen
+from search_index import SearchIndex
+from singleflight import SingleFlight
+
+
+class _Entry:
+    __slots__ = ("value", "loaded_at", "sync_token")
+
+    def __init__(self, value, sync_token):
+        self.value = value
+        self.loaded_at = monotonic()
+        self.sync_token = sync_token
+
+
+class DirectoryCache:
+    # Stale-while-revalidate: entries older than ttl are served while a background refresh runs,
+    # entries older than stale_ttl (or missing) are loaded before returning.
+    def __init__(self, ttl=300.0, stale_ttl=3600.0, max_size=10000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._flight = SingleFlight()
+        self._background: set = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.full_loads = 0
+        self.unchanged_syncs = 0
+        self.refresh_errors = 0
+        self.fallbacks = 0
+
+    async def get(self, key, load, changed=None):
+        # load(fresh) -> (value, sync_token), with fresh set when a change was detected and copies other workers
+        # cached are stale too; changed(sync_token) -> (unchanged, new_sync_token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = monotonic() - entry.loaded_at
+            if age <= self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.value
+            if age <= self.stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(key)
+                self._refresh_in_background(key, load, changed)
+                return entry.value
+        self.misses += 1
+        try:
+            return await self._flight.do(key, self._load, key, load, changed)
+        except (CircuitOpen, asyncio.TimeoutError):
+            # Asana is down or too slow: an expired entry is better than an empty modal
+            if entry is None:
+                raise
+            self.fallbacks += 1
+            return entry.value
+
+    def _refresh_in_background(self, key, load, changed):
+        task = asyncio.create_task(self._flight.do(key, self._load, key, load, changed))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            logs.error("asana.directory_refresh_failed", error=str(task.exception()))
+
+    async def _load(self, key, load, changed):
+        entry = self._entries.get(key)
+        fresh = False
+        if entry is not None and changed is not None and entry.sync_token is not None:
+            unchanged, sync_token = await changed(entry.sync_token)
+            if unchanged:
+                self.unchanged_syncs += 1
+                entry.loaded_at = monotonic()
+                entry.sync_token = sync_token
+                return entry.value
+            fresh = True
+
+        value, sync_token = await load(fresh)
+        self.full_loads += 1
+        self._entries[key] = _Entry(value, sync_token)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "full_loads": self.full_loads,
+            "unchanged_syncs": self.unchanged_syncs,
+            "refresh_errors": self.refresh_errors,
+            "fallbacks": self.fallbacks
+        }
+
+
+directory = DirectoryCache(
+    ttl=float(os.environ.get("ASANA_DIRECTORY_TTL", "300")),
+    stale_ttl=float(os.environ.get("ASANA_DIRECTORY_STALE_TTL", "3600")),
+    max_size=int(os.environ.get("ASANA_DIRECTORY_MAX_SIZE", "10000"))
+)
+
+# Upper bound on items streamed into one directory entry, so a huge workspace cannot exhaust memory
+max_items = int(os.environ.get("ASANA_DIRECTORY_MAX_ITEMS", "50000"))
+
+# Workspace events need a paid plan; workspaces that refuse them (402/403) always take a full load
+_events_unsupported: set = set()
+
+
+def _workspace_changes(workspace_id, asana_token, resource_types):
+    async def changed(sync_token):
+        if workspace_id in _events_unsupported:
+            return False, None
+        params = {"sync": sync_token} if sync_token else None
+        response = await asana_client.get(f"workspaces/{workspace_id}/events", asana_token, params, workspace_id)
+        if response.status_code == 412:
+            # Missing or expired sync token; Asana hands back a fresh one
+            return False, response.json().get('sync')
+        if response.status_code in (402, 403):
+            _events_unsupported.add(workspace_id)
+            return False, None
+        if not response.is_success:
+            # Rate limited or a transient error; full load this time, ask again next time
+            return False, None
+        body = response.json()
+        unchanged = not body.get('has_more') and not any(
+            event.get('resource', {}).get('resource_type') in resource_types for event in body['data'])
+        return unchanged, body.get('sync')
+    return changed
+
+
+def _shared(key, load, changed=None):
+    # Workers share the raw listings through the shared cache; each builds its own index from them.
+    # The sync token is taken before the listing is loaded, so changes made during the load are not
+    # missed, and stored with it, so no worker pairs a newer token with an older listing.
+    async def load_listing():
+        sync_token = (await changed(None))[1] if changed is not None else None
+        return {"sync": sync_token, "data": await load()}
+
+    async def load_shared(fresh):
+        listing = await shared_cache.load_json(f"asana_directory:{':'.join(key)}", directory.ttl, load_listing,
+                                               fresh)
+        return listing["data"], listing["sync"]
+    return load_shared
+
+
+async def workspaces(user_id, asana_token):
+    async def load():
+        data = [membership async for membership in
+                asana_client.paginate("users/me/workspace_memberships", asana_token, opt_fields=("workspace.name",))]
+        logs.payload("asana.workspaces", data, user_id=user_id)
+        return data
+    key = ("workspaces", user_id)
+    return await directory.get(key, _shared(key, load))
+
+
+async def project_index(workspace_id, user_id, asana_token):
+    # Project visibility is per user, so projects are cached per workspace and user
+    async def load():
+        options = [{"label": project['name'], "action_id": project['gid']} async for project in
+                   asana_client.paginate("projects", asana_token, {"workspace": workspace_id}, opt_fields=("name",),
+                                         max_items=max_items, workspace_id=workspace_id)]
+        logs.payload("asana.projects", options, workspace_id=workspace_id)
+        return options
+    key = ("projects", workspace_id, user_id)
+    changed = _workspace_changes(workspace_id, asana_token, ("project",))
+    load_options = _shared(key, load, changed)
+
+    async def load_index(fresh):
+        options, sync_token = await load_options(fresh)
+        return SearchIndex(options), sync_token
+    return await directory.get(key, load_index, changed)
+
+
+async def member_index(workspace_id, asana_token):
+    async def load():
+        options = [{"label": member['user']['name'], "action_id": member['user']['gid']} async for member in
+                   asana_client.paginate(f"workspaces/{workspace_id}/workspace_memberships", asana_token,
+                                         opt_fields=("user.name",), max_items=max_items,
+                                         workspace_id=workspace_id)]
+        logs.payload("asana.members", options, workspace_id=workspace_id)
+        return options
+    key = ("members", workspace_id)
+    changed = _workspace_changes(workspace_id, asana_token, ("user", "workspace_membership"))
+    load_options = _shared(key, load, changed)
+
+    async def load_index(fresh):
+        options, sync_token = await load_options(fresh)
+        return SearchIndex(options), sync_token
+    return await directory.get(key, load_index, changed)
+
+
+async def invalidate_user(user_id):
+    directory.invalidate(("workspaces", user_id))
+    await shared_cache.delete(f"asana_directory:workspaces:{user_id}")
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import views  # noqa: E402,F401
+from templates import Slot, registry  # noqa: E402
+
+sample_values = {
+    "state": "asana_create:24012409543257ODXSGR",
+    "oauth_url": "https://openapi.swit.io/oauth/authorize?client_id=abc&state=u:asana_create:ko:c",
+    "channel_id": "24012409543257ODXSGR",
+    "pre_filled_message": "Follow up on the release notes",
+    "assignee_options": [{"label": f"Member {i}", "action_id": str(1200000000000000 + i)} for i in range(200)],
+    "project_options": [{"label": f"Project {i}", "action_id": str(1100000000000000 + i)} for i in range(200)],
+    "user_id": "240124095432USER",
+    "content": "{\"type\":\"rich_text\",\"elements\":[]}"
+}
+
+
+def build(node, values):
+    # Rebuilds the nested dict on every call, the way the handlers did before templates
+    if isinstance(node, Slot):
+        return values[node.name]
+    if isinstance(node, dict):
+        return {key: build(value, values) for key, value in node.items()}
+    if isinstance(node, list):
+        return [build(value, values) for value in node]
+    return node
+
+
+def main(number=2000):
+    print(f"{'template':<22}{'dict + json.dumps':>20}{'template render':>18}")
+    for name, template in registry.items():
+        values = {slot: sample_values[slot] for slot in template.slots}
+        baseline = timeit.timeit(lambda: json.dumps(build(template.structure, values)).encode(), number=number)
+        rendered = timeit.timeit(lambda: template.render_bytes(**values), number=number)
+        print(f"{name:<22}{baseline / number * 1e6:>17.1f} us{rendered / number * 1e6:>15.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+# Runs against the database configured by the DB_* variables, in scratch tables it drops afterwards
+users = int(os.environ.get("BENCH_USERS", "1000000"))
+batch_size = 5000
+
+schemas = {
+    "before migrations": """
+        CREATE TABLE bench_userdata (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            swit_id VARCHAR(255),
+            asana_id VARCHAR(255),
+            asana_token TEXT,
+            asana_refresh_token VARCHAR(255),
+            swit_token TEXT,
+            swit_refresh_token VARCHAR(255)
+        )""",
+    "after migrations": """
+        CREATE TABLE bench_userdata (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            swit_id VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+            asana_id VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            asana_token VARCHAR(2048) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            asana_refresh_token VARCHAR(512) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            swit_token VARCHAR(2048) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            swit_refresh_token VARCHAR(512) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            UNIQUE INDEX userdata_swit_id (swit_id)
+        )"""
+}
+
+
+def swit_id(i):
+    return f"{24012409543257 + i}USER"
+
+
+def populate(connection):
+    token = "t" * 400
+    with connection.cursor() as cursor:
+        for start in range(0, users, batch_size):
+            rows = [(swit_id(i), str(1200000000000000 + i), token, "r" * 40, token, "r" * 40)
+                    for i in range(start, min(start + batch_size, users))]
+            cursor.executemany(
+                "INSERT INTO bench_userdata (swit_id, asana_id, asana_token, asana_refresh_token, swit_token, "
+                "swit_refresh_token) VALUES (%s, %s, %s, %s, %s, %s)", rows)
+            connection.commit()
+
+
+def lookups(connection, count):
+    # The credential query the webhook handler runs on every cache miss
+    timings = []
+    with connection.cursor(buffered=True) as cursor:
+        for _ in range(count):
+            started = perf_counter()
+            cursor.execute("SELECT swit_token, swit_refresh_token, asana_token, asana_refresh_token "
+                           "FROM bench_userdata WHERE swit_id = %s", (swit_id(random.randrange(users)),))
+            cursor.fetchone()
+            timings.append(perf_counter() - started)
+    timings.sort()
+    return timings
+
+
+def main():
+    connection = db.create_db_connection()
+    print(f"{users} users")
+    print(f"{'schema':<20}{'p50':>12}{'p99':>12}")
+    try:
+        for name, schema in schemas.items():
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS bench_userdata")
+                cursor.execute(schema)
+            populate(connection)
+            # Full scans take long at this size, so fewer samples for the unindexed table
+            timings = lookups(connection, 20 if name == "before migrations" else 2000)
+            p50 = timings[len(timings) // 2]
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            print(f"{name:<20}{p50 * 1e3:>9.2f} ms{p99 * 1e3:>9.2f} ms")
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_userdata")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("VAULT_KEY_FILE", os.path.join(tempfile.mkdtemp(), "vault.key"))
+
+import vault  # noqa: E402
+
+# A webhook pays for decryption only when it misses the credential cache, and then it unseals the four
+# token columns of the row
+budget_us = float(os.environ.get("BENCH_MISS_BUDGET_US", "50"))
+swit_id = "24012409543257ODXSGR"
+token = "eyJhbGciOiJIUzI1NiJ9." + "x" * 600 + ".signature"
+columns = ("swit_token", "swit_refresh_token", "asana_token", "asana_refresh_token")
+
+
+def main(number=20000):
+    sealed = vault.encrypt(token, swit_id, "swit_token")
+    assert vault.decrypt(sealed, swit_id, "swit_token") == token
+
+    row = [vault.encrypt(token, swit_id, column) for column in columns]
+
+    def unseal_row():
+        for value, column in zip(row, columns):
+            vault.decrypt(value, swit_id, column)
+
+    def cold_decrypt():
+        vault.get()._data_keys.clear()
+        vault.decrypt(sealed, swit_id, "swit_token")
+
+    timings = {
+        "encrypt": timeit.timeit(lambda: vault.encrypt(token, swit_id, "swit_token"), number=number),
+        "decrypt, cached data key": timeit.timeit(lambda: vault.decrypt(sealed, swit_id, "swit_token"), number=number),
+        "decrypt, cold data key": timeit.timeit(cold_decrypt, number=number),
+        "cache miss, unseal row": timeit.timeit(unseal_row, number=number)
+    }
+    print(f"{'operation':<28}{'per call':>12}")
+    for name, total in timings.items():
+        print(f"{name:<28}{total / number * 1e6:>9.2f} us")
+
+    miss = timings["cache miss, unseal row"] / number * 1e6
+    verdict = "within" if miss < budget_us else "over"
+    print(f"added cost of a credential cache miss: {miss:.2f} us ({verdict} the {budget_us:g} us budget); "
+          "cache hits return the plaintext and decrypt nothing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import asyncio
+import random
+import re
+import sqlite3
+from urllib.parse import parse_qs
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class Injector:
+    # Latency (mean +- jitter, in seconds) and a failure rate applied to every request a fake serves
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.injected_errors = 0
+
+    async def __call__(self):
+        self.requests += 1
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < self.error_rate:
+            self.injected_errors += 1
+            return JSONResponse({"error": "injected"}, status_code=503)
+        return None
+
+
+def swit_app(injector: Injector) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/oauth/token")
+    async def token(request: Request):
+        error = await injector()
+        if error:
+            return error
+        code = parse_qs((await request.body()).decode()).get('code', [""])[0]
+        return {"access_token": f"swit-access-{random.getrandbits(48):x}",
+                "refresh_token": f"swit-refresh-{code}{random.getrandbits(48):x}", "expires_in": 3600}
+
+    @app.post("/v1/api/message.create")
+    async def message_create(request: Request):
+        error = await injector()
+        if error:
+            return error
+        body = await request.json()
+        return {"data": {"message": {"message_id": f"{random.getrandbits(48):x}",
+                                     "channel_id": body.get('channel_id')}}}
+
+    return app
+
+
+def asana_app(injector: Injector, projects=200, members=200) -> FastAPI:
+    app = FastAPI()
+    project_rows = [{"gid": str(1100000000000000 + i), "name": f"Project {i}"} for i in range(projects)]
+    member_rows = [{"user": {"gid": str(1200000000000000 + i), "name": f"Member {i}"}} for i in range(members)]
+
+    def page(rows, request):
+        limit = int(request.query_params.get('limit', 100))
+        offset = int(request.query_params.get('offset') or 0)
+        next_offset = offset + limit
+        return {"data": rows[offset:next_offset],
+                "next_page": {"offset": str(next_offset)} if next_offset < len(rows) else None}
+
+    @app.post("/-/oauth_token")
+    async def token(request: Request):
+        error = await injector()
+        if error:
+            return error
+        return {"access_token": f"asana-access-{random.getrandbits(48):x}",
+                "refresh_token": f"asana-refresh-{random.getrandbits(48):x}",
+                "expires_in": 3600,
+                "data": {"gid": str(random.getrandbits(50))}}
+
+    @app.get("/api/1.0/users/me/workspace_memberships")
+    async def workspaces():
+        error = await injector()
+        if error:
+            return error
+        return {"data": [{"workspace": {"gid": "1000000000000001", "name": "Bench"}}], "next_page": None}
+
+    @app.get("/api/1.0/projects")
+    async def list_projects(request: Request):
+        error = await injector()
+        if error:
+            return error
+        return page(project_rows, request)
+
+    @app.get("/api/1.0/workspaces/{workspace_id}/workspace_memberships")
+    async def list_members(workspace_id: str, request: Request):
+        error = await injector()
+        if error:
+            return error
+        return page(member_rows, request)
+
+    @app.get("/api/1.0/workspaces/{workspace_id}/events")
+    async def events(workspace_id: str, request: Request):
+        error = await injector()
+        if error:
+            return error
+        if not request.query_params.get('sync'):
+            return JSONResponse({"sync": "sync-0"}, status_code=412)
+        return {"data": [], "sync": "sync-0", "has_more": False}
+
+    @app.post("/api/1.0/tasks")
+    async def create_task(request: Request):
+        error = await injector()
+        if error:
+            return error
+        data = (await request.json())['data']
+        return {"data": {"gid": str(random.getrandbits(50)),
+                         "projects": [{"name": "Project"}] if data.get('projects') else [],
+                         "assignee": {"name": "Member"} if data.get('assignee') else None}}
+
+    return app
+
+
+async def start_server(app, host="127.0.0.1", port=0):
+    # Serves app on the running loop; returns (server, serve task, base_url) once it is listening
+    config = uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False, lifespan="off")
+    server = uvicorn.Server(config)
+    server.install_signal_handlers = lambda: None
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    bound_port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, f"http://{host}:{bound_port}"
+
+
+# SQLite stand-in for mysql.connector, enough for what db.py and main.py use
+
+_upsert = re.compile(r"ON DUPLICATE KEY UPDATE", re.IGNORECASE)
+_values = re.compile(r"VALUES\((\w+)\)")
+
+
+def translate(query: str) -> str:
+    query = query.replace("%s", "?")
+    if _upsert.search(query):
+        query = _upsert.sub("ON CONFLICT(swit_id) DO UPDATE SET", query)
+        query = _values.sub(r"excluded.\1", query)
+    return query
+
+
+class SqliteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def execute(self, query, params=()):
+        self._cursor.execute(translate(query), params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+
+class SqliteConnection:
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+
+    def cursor(self, buffered=False):
+        return SqliteCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def ping(self, reconnect=False):
+        self._connection.execute("SELECT 1")
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._connection.close()
+
+
+def create_schema(path):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""
+    CREATE TABLE IF NOT EXISTS userdata (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        swit_id TEXT NOT NULL UNIQUE,
+        asana_id TEXT,
+        asana_token TEXT,
+        asana_refresh_token TEXT,
+        swit_token TEXT,
+        swit_refresh_token TEXT,
+        swit_expires_at INTEGER,
+        asana_expires_at INTEGER,
+        swit_refresh_failures INTEGER NOT NULL DEFAULT 0,
+        asana_refresh_failures INTEGER NOT NULL DEFAULT 0
+    )""")
+    connection.commit()
+    connection.close()
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from collections import defaultdict
+from time import perf_counter, time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import fake_services  # noqa: E402
+
+# Drives the real app in-process against fake Swit and Asana servers and a SQLite stand-in for MySQL.
+# The load generator shares the process with the app, so compare runs with each other, not with production.
+
+scenarios = ("help", "create", "create_button", "oauth", "asana_oauth")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=(*scenarios, "all"), default="all")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--swit-latency", type=float, default=20.0, help="ms")
+    parser.add_argument("--asana-latency", type=float, default=40.0, help="ms")
+    parser.add_argument("--jitter", type=float, default=10.0, help="ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake responses that are 503")
+    return parser.parse_args()
+
+
+class Breakdown:
+    # Wall time spent waiting on each dependency, summed over all calls made while a scenario runs
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def record(self, name, elapsed):
+        self.calls[name] += 1
+        self.seconds[name] += elapsed
+
+    def reset(self):
+        self.calls.clear()
+        self.seconds.clear()
+
+
+def instrument(http_client, db, hosts, breakdown):
+    request = http_client.request
+    run = db.run
+
+    async def timed_request(method, url, **kwargs):
+        started = perf_counter()
+        try:
+            return await request(method, url, **kwargs)
+        finally:
+            breakdown.record(hosts.get(urlsplit(url).netloc, "other"), perf_counter() - started)
+
+    async def timed_run(fn, *args):
+        started = perf_counter()
+        try:
+            return await run(fn, *args)
+        finally:
+            breakdown.record("db", perf_counter() - started)
+
+    http_client.request = timed_request
+    db.run = timed_run
+
+
+def seed(path, users, vault):
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO userdata (swit_id, asana_id, asana_token, asana_refresh_token, swit_token, swit_refresh_token) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(user_id(i), str(1300000000000000 + i),
+          vault.encrypt(f"asana-access-{i}", user_id(i), "asana_token"),
+          vault.encrypt(f"asana-refresh-{i}", user_id(i), "asana_refresh_token"),
+          vault.encrypt(f"swit-access-{i}", user_id(i), "swit_token"),
+          vault.encrypt(f"swit-refresh-{i}", user_id(i), "swit_refresh_token")) for i in range(users)])
+    connection.commit()
+    connection.close()
+
+
+def user_id(i):
+    return f"bench-user-{i}"
+
+
+def webhook(main, codec, scenario, n, users):
+    user = user_id(random.randrange(users))
+    payload = {
+        "user_info": {"user_id": user},
+        "user_preferences": {"language": "en"},
+        "context": {"channel_id": "bench-channel"},
+        # Unique per request, so the replay guard does not drop it
+        "delivery": n
+    }
+    if scenario == "help":
+        payload['user_action'] = {"id": "asana_help", "type": "user_commands.chat"}
+    elif scenario == "create":
+        payload['user_action'] = {"id": "asana_create", "type": "user_commands.chat"}
+    else:
+        payload['user_action'] = {"id": "asana_create_button", "type": "view_actions.submit"}
+        payload['current_view'] = {"state": "bench-channel", "body": {"elements": [
+            {"action_id": main.views.task_name_action_id, "value": f"Bench task {n}"},
+            {"action_id": main.views.project_action_id, "value": ["1100000000000001"]},
+            {"action_id": main.views.assignee_action_id, "value": ["1200000000000001"]},
+            {"action_id": main.views.task_description_action_id, "value": "Created by the load test"}
+        ]}}
+    body = codec.dumps(payload)
+    timestamp = str(int(time()))
+    headers = {
+        "content-type": "application/json",
+        "x-swit-request-timestamp": timestamp,
+        "x-swit-signature": main._generate_signature(body, timestamp)
+    }
+    return "POST", "/app/asana22", {"content": body, "headers": headers}
+
+
+def request_for(main, codec, scenario, n, users):
+    if scenario in ("help", "create", "create_button"):
+        return webhook(main, codec, scenario, n, users)
+    state = f"{user_id(random.randrange(users))}:asana_create:en:bench-channel"
+    path = "/oauth" if scenario == "oauth" else "/asana_oauth"
+    return "GET", path, {"params": {"code": f"code-{n}", "state": state}}
+
+
+async def run_scenario(client, main, codec, scenario, args, breakdown):
+    latencies = []
+    errors = 0
+    counter = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            method, path, kwargs = request_for(main, codec, scenario, n, args.users)
+            started = perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(perf_counter() - started)
+            # The OAuth handlers report failures as a 200 {"error": ...} body
+            if response.status_code >= 400 or response.content.startswith(b'{"error"'):
+                errors += 1
+
+    breakdown.reset()
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = perf_counter() - started
+    report(scenario, latencies, errors, elapsed, breakdown)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(scenario, latencies, errors, elapsed, breakdown):
+    latencies.sort()
+    count = len(latencies)
+    print(f"\n{scenario}: {count} requests in {elapsed:.2f}s, {count / elapsed:.1f} req/s, {errors} errors")
+    print("  latency ms  " + "  ".join(f"{name} {percentile(latencies, p) * 1e3:.1f}"
+                                       for name, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))))
+    for name in sorted(breakdown.calls):
+        calls = breakdown.calls[name]
+        seconds = breakdown.seconds[name]
+        print(f"  {name:<6} {calls:>7} calls  {seconds / calls * 1e3:>8.2f} ms/call  "
+              f"{seconds / count * 1e3:>8.2f} ms/request")
+
+
+async def drain(task_jobs, timeout=60.0):
+    # Lets queued task creations finish against the fakes before they shut down
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        counts = (await task_jobs.stats())['jobs']
+        if not counts.get('pending') and not counts.get('running'):
+            return
+        await asyncio.sleep(0.2)
+
+
+async def main_async(args):
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    swit = fake_services.Injector(args.swit_latency / 1e3, args.jitter / 1e3, args.error_rate)
+    asana = fake_services.Injector(args.asana_latency / 1e3, args.jitter / 1e3, args.error_rate)
+    swit_server, swit_task, swit_url = await fake_services.start_server(fake_services.swit_app(swit))
+    asana_server, asana_task, asana_url = await fake_services.start_server(fake_services.asana_app(asana))
+
+    # The app reads its configuration at import time
+    os.environ.update({
+        "SWIT_SIGNING_KEY": "loadtest",
+        "SWIT_API_URL": swit_url + "/",
+        "ASANA_URL": asana_url,
+        "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "VAULT_KEY_FILE": os.path.join(workdir, "vault.key"),
+        "TOKEN_REFRESH_ENABLED": "0",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+        "DB_POOL_MAX_SIZE": os.environ.get("DB_POOL_MAX_SIZE", "10")
+    })
+    import codec
+    import db
+    import http_client
+    import main
+    import migrations
+    import vault
+
+    db_path = os.path.join(workdir, "userdata.sqlite3")
+    fake_services.create_schema(db_path)
+    seed(db_path, args.users, vault)
+    db.create_db_connection = lambda: fake_services.SqliteConnection(db_path)
+
+    async def no_migrations():
+        pass
+    migrations.run = no_migrations
+
+    breakdown = Breakdown()
+    instrument(http_client, db, {urlsplit(swit_url).netloc: "swit", urlsplit(asana_url).netloc: "asana"},
+               breakdown)
+
+    print(f"{args.concurrency} concurrent clients, {args.users} users, swit {args.swit_latency:g} ms, "
+          f"asana {args.asana_latency:g} ms, error rate {args.error_rate:g}")
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with main.lifespan(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+                for scenario in scenarios if args.scenario == "all" else (args.scenario,):
+                    await run_scenario(client, main, codec, scenario, args, breakdown)
+            await drain(main.task_jobs)
+            print(f"\njobs: {(await main.task_jobs.stats())['jobs']}")
+    finally:
+        swit_server.should_exit = True
+        asana_server.should_exit = True
+        await asyncio.gather(swit_task, asana_task)
+    print(f"fake swit served {swit.requests} ({swit.injected_errors} injected errors), "
+          f"fake asana served {asana.requests} ({asana.injected_errors} injected errors)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async(parse_args()))
@@ -0,0 +1,126 @@
+import asyncio
+import os
+from time import monotonic
+
+import logs
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def server_error(result) -> bool:
+    return getattr(result, "status_code", 0) >= 500
+
+
+class CircuitBreaker:
+    # closed: calls pass through; open: calls fail immediately until reset_timeout has passed;
+    # half_open: a single probe call decides whether to close again or stay open
+    def __init__(self, name, timeout=None, failure_threshold=5, reset_timeout=30.0, is_failure=None, ignore=()):
+        # is_failure(result) flags bad results (e.g. 5xx responses); exceptions in ignore are the caller's
+        # fault (bad query, duplicate key) and say nothing about the dependency's health
+        self.name = name
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.ignore = ignore
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.calls = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def is_open(self) -> bool:
+        return self.state == "open" and monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        if self.state != "closed":
+            logs.info("breaker.closed", dependency=self.name)
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, error):
+        self.failed += 1
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+                logs.warning("breaker.opened", dependency=self.name, failures=self.failures, error=error)
+            self.state = "open"
+            self.opened_at = monotonic()
+            self._probing = False
+
+    async def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            self.rejected += 1
+            raise CircuitOpen(self.name)
+        self.calls += 1
+        try:
+            if self.timeout:
+                result = await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+            else:
+                result = await fn(*args, **kwargs)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.record_failure("timeout")
+            raise
+        except (asyncio.CancelledError, *self.ignore):
+            # The caller went away or made a mistake; neither a success nor a failure of the dependency,
+            # so the failure count stands and a half-open breaker lets the next call probe
+            self._probing = False
+            raise
+        except Exception as e:
+            self.record_failure(repr(e))
+            raise
+        if self.is_failure is not None and self.is_failure(result):
+            self.record_failure(f"status {result.status_code}")
+        else:
+            self.record_success()
+        return result
+
+    def stats(self):
+        return {
+            "state": "open" if self.is_open() else ("closed" if self.state == "closed" else "half_open"),
+            "consecutive_failures": self.failures,
+            "calls": self.calls,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "opened": self.opened
+        }
+
+
+failure_threshold = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+reset_timeout = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+
+breakers: dict[str, CircuitBreaker] = {}
+
+
+def register(name, timeout=None, is_failure=server_error, ignore=()) -> CircuitBreaker:
+    # One breaker per dependency; timeout is the whole-call deadline, on top of any per-phase client timeouts
+    breaker = breakers[name] = CircuitBreaker(name, timeout=timeout, failure_threshold=failure_threshold,
+                                              reset_timeout=reset_timeout, is_failure=is_failure, ignore=ignore)
+    return breaker
+
+
+def stats():
+    return {name: breaker.stats() for name, breaker in breakers.items()}
@@ -0,0 +1,72 @@
+import json
+from dataclasses import dataclass, field
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(value, status_code=200) -> Response:
+    return Response(content=dumps(value), status_code=status_code, media_type="application/json")
+
+
+@dataclass(slots=True)
+class WebhookEvent:
+    user_id: str
+    user_language: str
+    channel_id: str | None
+    user_action_id: str
+    user_action_type: str
+    user_action_value: object = None
+    resource_content: str | None = None
+    view_state: str | None = None
+    view_values: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "WebhookEvent":
+        user_action = payload['user_action']
+        current_view = payload.get('current_view') or {}
+        # Form values keyed by element action_id instead of element position
+        view_values = {
+            element['action_id']: element.get('value')
+            for element in (current_view.get('body') or {}).get('elements', ())
+            if 'action_id' in element
+        }
+        return cls(
+            user_id=payload['user_info']['user_id'],
+            user_language=payload['user_preferences']['language'],
+            channel_id=(payload.get('context') or {}).get('channel_id'),
+            user_action_id=user_action['id'],
+            user_action_type=user_action['type'],
+            user_action_value=user_action.get('value'),
+            resource_content=(user_action.get('resource') or {}).get('content'),
+            view_state=current_view.get('state'),
+            view_values=view_values
+        )
+
+    def value(self, action_id):
+        return self.view_values.get(action_id)
+
+    def first_value(self, action_id):
+        value = self.view_values.get(action_id)
+        return value[0] if value else None
+
+
+def decode_webhook(body: bytes) -> WebhookEvent:
+    return WebhookEvent.from_payload(loads(body))
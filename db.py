@@ -0,0 +1,279 @@
+import asyncio
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+import mysql.connector
+from mysql.connector import DataError, Error, IntegrityError, ProgrammingError
+
+import breaker
+import logs
+import metrics
+import tracing
+
+db_host = os.environ.get("DB_HOST", "localhost")
+db_port = int(os.environ.get("DB_PORT", "3306"))
+db_user = os.environ.get("DB_USER", "root")
+db_password = os.environ.get("DB_PASSWORD")
+db_name = os.environ.get("DB_NAME")
+
+pool_min_size = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+pool_max_size = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+pool_acquire_timeout = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", "2"))
+pool_recycle = float(os.environ.get("DB_POOL_RECYCLE", "300"))  # close connections idle longer than this
+pool_health_check_interval = float(os.environ.get("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+connect_timeout = int(os.environ.get("DB_CONNECT_TIMEOUT", "5"))
+query_timeout = float(os.environ.get("DB_QUERY_TIMEOUT", "5"))
+
+# A pool that is only busy has to fail as PoolTimeout before the query deadline fires, since a deadline
+# timeout counts against the breaker
+pool_acquire_timeout = min(pool_acquire_timeout, query_timeout / 2)
+
+
+class PoolTimeout(Error):
+    pass
+
+
+# Query mistakes, constraint violations and a saturated pool say nothing about the server's health,
+# so they do not trip the breaker
+circuit = breaker.register("mysql", query_timeout, is_failure=None,
+                           ignore=(DataError, IntegrityError, ProgrammingError, PoolTimeout))
+
+
+def create_db_connection():
+    # Autocommit, so a pooled connection that has only served reads does not keep an old REPEATABLE READ
+    # snapshot and miss rows committed since; multi-statement writes open their own transaction
+    return mysql.connector.connect(
+        host=db_host,
+        port=db_port,
+        user=db_user,
+        password=db_password,
+        database=db_name,
+        connection_timeout=connect_timeout,
+        autocommit=True
+    )
+
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=10, acquire_timeout=5.0, recycle=300.0,
+                 health_check_interval=30.0):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.recycle = recycle
+        self.health_check_interval = health_check_interval
+
+        # LIFO so hot connections are reused and cold ones age out through recycle
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.opened = 0
+        self.in_use = 0
+        self.acquired = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.health_check_failures = 0
+
+    def fill(self):
+        for _ in range(self.min_size - self._idle.qsize()):
+            self._idle.put((self._open(), monotonic()))
+
+    def _open(self):
+        connection = self._connect()
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _is_healthy(self, connection, idle_for):
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Error:
+            with self._lock:
+                self.health_check_failures += 1
+            return False
+
+    def acquire(self):
+        if self._closed:
+            raise Error("Connection pool is closed")
+        waited = 0.0
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            started = monotonic()
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                with self._lock:
+                    self.timeouts += 1
+                    metrics.db_pool_wait_seconds.observe(monotonic() - started)
+                raise PoolTimeout(f"Timed out waiting {self.acquire_timeout}s for a database connection")
+            waited = monotonic() - started
+
+        try:
+            while True:
+                try:
+                    connection, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    connection = self._open()
+                    break
+
+                idle_for = monotonic() - last_used
+                if idle_for > self.recycle:
+                    with self._lock:
+                        self.recycled += 1
+                    self._discard(connection)
+                    continue
+                if not self._is_healthy(connection, idle_for):
+                    self._discard(connection)
+                    continue
+                break
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+            # Acquire runs on worker threads, so the histogram is only updated under the pool lock
+            metrics.db_pool_wait_seconds.observe(waited)
+        return connection
+
+    def release(self, connection, broken=False):
+        # No is_connected() here: it pings the server, a second round trip on every query. A connection
+        # that died while idle is caught by the ping in acquire, one that died mid-query by the failed rollback.
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if self._closed or broken:
+                self._discard(connection)
+            else:
+                self._idle.put((connection, monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        broken = False
+        try:
+            yield connection
+        except BaseException:
+            try:
+                connection.rollback()
+            except Error:
+                broken = True
+            raise
+        finally:
+            self.release(connection, broken)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "in_use": self.in_use,
+            "idle": self._idle.qsize(),
+            "opened": self.opened,
+            "acquired": self.acquired,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "health_check_failures": self.health_check_failures
+        }
+
+
+pool: ConnectionPool | None = None
+
+
+def init_pool():
+    global pool
+    if pool is None:
+        pool = ConnectionPool(
+            create_db_connection,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            acquire_timeout=pool_acquire_timeout,
+            recycle=pool_recycle,
+            health_check_interval=pool_health_check_interval
+        )
+        try:
+            pool.fill()
+        except Error as e:
+            logs.error("db.pool_fill_failed", error=str(e))
+    return pool
+
+
+def close_pool():
+    global pool
+    if pool is not None:
+        pool.close()
+        pool = None
+
+
+def pool_stats():
+    return pool.stats() if pool is not None else {}
+
+
+def _run(fn, *args):
+    with init_pool().connection() as connection:
+        return fn(connection, *args)
+
+
+async def run(fn, *args):
+    # mysql.connector is blocking, so queries run on the default thread pool off the event loop.
+    # On timeout the caller gets control back; the thread finishes in the background and releases its connection.
+    return await circuit.call(asyncio.to_thread, _run, fn, *args)
+
+
+def _fetch_one(connection, query, params):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchone()
+
+
+def _fetch_all(connection, query, params):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def _execute(connection, query, params):
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        connection.commit()
+        return cursor.rowcount
+
+
+async def fetch_one(query, params=()):
+    with tracing.span("db.fetch_one", {"db.system": "mysql", "db.statement": query}):
+        return await run(_fetch_one, query, params)
+
+
+async def fetch_all(query, params=()):
+    with tracing.span("db.fetch_all", {"db.system": "mysql", "db.statement": query}):
+        return await run(_fetch_all, query, params)
+
+
+async def execute(query, params=()):
+    with tracing.span("db.execute", {"db.system": "mysql", "db.statement": query}):
+        return await run(_execute, query, params)
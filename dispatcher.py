@@ -0,0 +1,124 @@
+import asyncio
+from time import perf_counter
+
+import logs
+from ratelimit import BucketRegistry
+
+
+def _can_merge(content):
+    return isinstance(content, dict) and content.get('type') == "rich_text"
+
+
+class MessageDispatcher:
+    def __init__(self, send, rate=5.0, burst=10, linger=0.05, max_batch=10):
+        # send(channel_id, swit_token, content) -> response; content is a dict or a pre-encoded JSON string
+        self.send = send
+        self.rate = rate
+        self.burst = burst
+        self.linger = linger
+        self.max_batch = max_batch
+
+        self._pending: dict[tuple, list] = {}
+        self._flushers: dict[tuple, asyncio.Task] = {}
+        self._buckets = BucketRegistry(rate, burst)
+        self._closed = False
+
+        self.submitted = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.send_seconds = 0.0
+        self.max_send_seconds = 0.0
+
+    async def submit(self, channel_id, swit_token, content):
+        # Resolves with the message.create response of the (possibly shared) request carrying this message
+        key = (channel_id, swit_token)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((content, future))
+        self.submitted += 1
+        if key not in self._flushers:
+            self._flushers[key] = asyncio.create_task(self._flush(key))
+        return await future
+
+    def _next_batch(self, key):
+        # Consecutive rich_text messages are merged into one; anything else is sent on its own
+        pending = self._pending[key]
+        batch = [pending.pop(0)]
+        if _can_merge(batch[0][0]):
+            while pending and len(batch) < self.max_batch and _can_merge(pending[0][0]):
+                batch.append(pending.pop(0))
+        return batch
+
+    async def _flush(self, key):
+        channel_id, swit_token = key
+        batch = []
+        try:
+            # Linger only when there is something to merge with; pre-rendered content goes out right away
+            if _can_merge(self._pending[key][0][0]):
+                await asyncio.sleep(self.linger)
+            while self._pending.get(key):
+                batch = self._next_batch(key)
+                if len(batch) == 1:
+                    content = batch[0][0]
+                else:
+                    content = {
+                        "type": "rich_text",
+                        "elements": [element for message, _ in batch for element in message['elements']]
+                    }
+                    self.coalesced += len(batch) - 1
+
+                await self._buckets.acquire(swit_token)
+                started = perf_counter()
+                try:
+                    response = await self.send(channel_id, swit_token, content)
+                except Exception as e:
+                    self.errors += 1
+                    logs.error("swit.dispatch_failed", channel_id=channel_id, error=repr(e))
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                finally:
+                    elapsed = perf_counter() - started
+                    self.requests += 1
+                    self.send_seconds += elapsed
+                    self.max_send_seconds = max(self.max_send_seconds, elapsed)
+
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(response)
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+            del self._flushers[key]
+            if not self._pending.get(key):
+                self._pending.pop(key, None)
+            elif not self._closed:
+                self._flushers[key] = asyncio.create_task(self._flush(key))
+
+    async def close(self):
+        self._closed = True
+        flushers = list(self._flushers.values())
+        for task in flushers:
+            task.cancel()
+        await asyncio.gather(*flushers, return_exceptions=True)
+        for messages in self._pending.values():
+            for _, future in messages:
+                if not future.done():
+                    future.cancel()
+        self._pending.clear()
+
+    def queue_depth(self):
+        return sum(len(messages) for messages in self._pending.values())
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "submitted": self.submitted,
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "avg_send_seconds": self.send_seconds / self.requests if self.requests else 0.0,
+            "max_send_seconds": self.max_send_seconds
+        }
@@ -0,0 +1,83 @@
+import os
+from urllib.parse import urlsplit
+
+import httpx
+
+import tracing
+
+try:
+    import h2  # noqa: F401
+    http2_available = True
+except ImportError:
+    http2_available = False
+
+
+def _parse_host_limits(value: str) -> dict[str, int]:
+    # HTTP_HOST_LIMITS="app.asana.com=50,openapi.swit.io=100"
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        host, limit = item.split("=", 1)
+        limits[host.strip().lower()] = int(limit)
+    return limits
+
+
+max_connections = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+max_keepalive_connections = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+keepalive_expiry = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+connect_timeout = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+read_timeout = float(os.environ.get("HTTP_READ_TIMEOUT", "15"))
+pool_timeout = float(os.environ.get("HTTP_POOL_TIMEOUT", "5"))
+host_limits = _parse_host_limits(os.environ.get("HTTP_HOST_LIMITS", ""))
+use_http2 = http2_available and os.environ.get("HTTP_HTTP2", "1") != "0"
+
+# One pooled client per upstream host so each host gets its own connection limit
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client(host: str) -> httpx.AsyncClient:
+    host_max = host_limits.get(host, max_connections)
+    limits = httpx.Limits(
+        max_connections=host_max,
+        max_keepalive_connections=min(max_keepalive_connections, host_max),
+        keepalive_expiry=keepalive_expiry
+    )
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=use_http2)
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    host = urlsplit(url).netloc.lower()
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        client = _create_client(host)
+        _clients[host] = client
+    return client
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    parts = urlsplit(url)
+    with tracing.span(f"HTTP {method}", {"http.method": method, "server.address": parts.netloc,
+                                         "url.path": parts.path}) as span:
+        kwargs["headers"] = tracing.inject(kwargs.get("headers"))
+        response = await get_client(url).request(method, url, **kwargs)
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f"HTTP {response.status_code}")
+        return response
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,229 @@
+import asyncio
+import sqlite3
+import threading
+from random import random
+from time import time
+
+import codec
+import logs
+import tracing
+
+
+class PermanentError(Exception):
+    # Raised by a handler when retrying cannot help; the job is marked failed immediately
+    pass
+
+
+class Job:
+    __slots__ = ("id", "kind", "payload", "attempts", "_queue")
+
+    def __init__(self, job_id, kind, payload, attempts, job_queue):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self._queue = job_queue
+
+    async def checkpoint(self):
+        # Persists payload changes so a retry resumes after the steps that already succeeded
+        await self._queue._call(self._queue._save_payload, self.id, self.payload)
+
+
+class JobQueue:
+    def __init__(self, path, handlers, workers=4, max_attempts=5, base_delay=1.0, max_delay=60.0, lease=300.0,
+                 poll_interval=1.0, retention=86400.0, shutdown_grace=10.0):
+        # handlers: {kind: async fn(job)}
+        self.path = path
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.shutdown_grace = shutdown_grace
+
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._wakeup: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+        self._last_purge = 0.0
+
+        self.enqueued = 0
+        self.duplicates = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            idempotency_key TEXT UNIQUE,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )""")
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at)")
+        return connection
+
+    async def _call(self, fn, *args):
+        return await asyncio.to_thread(self._locked, fn, *args)
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            return fn(self._connection, *args)
+
+    @staticmethod
+    def _insert(connection, kind, payload, idempotency_key):
+        now = time()
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO jobs (kind, idempotency_key, payload, run_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, idempotency_key, codec.dumps(payload).decode(), now, now, now))
+        return cursor.rowcount == 1
+
+    def _claim(self, connection):
+        # One statement, so workers in other processes sharing the file cannot claim the same job.
+        # Jobs left running past their lease (a crashed worker) become claimable again.
+        now = time()
+        return connection.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE (status = 'pending' AND run_at <= ?) "
+            "OR (status = 'running' AND updated_at < ?) ORDER BY run_at LIMIT 1) "
+            "RETURNING id, kind, payload, attempts",
+            (now, now, now - self.lease)).fetchone()
+
+    @staticmethod
+    def _save_payload(connection, job_id, payload):
+        connection.execute("UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+                           (codec.dumps(payload).decode(), time(), job_id))
+
+    @staticmethod
+    def _finish(connection, job_id, status, run_at, error):
+        connection.execute("UPDATE jobs SET status = ?, run_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                           (status, run_at, error, time(), job_id))
+
+    @staticmethod
+    def _release(connection, job_id):
+        # Hands a claimed job back without counting the interrupted attempt
+        now = time()
+        connection.execute("UPDATE jobs SET status = 'pending', attempts = attempts - 1, run_at = ?, updated_at = ? "
+                           "WHERE id = ?", (now, now, job_id))
+
+    def _purge(self, connection):
+        connection.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                           (time() - self.retention,))
+
+    @staticmethod
+    def _counts(connection):
+        return dict(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    async def enqueue(self, kind, payload, idempotency_key=None) -> bool:
+        # Returns False when a job with the same idempotency key was already queued
+        inserted = await self._call(self._insert, kind, payload, idempotency_key)
+        if inserted:
+            self.enqueued += 1
+            if self._wakeup is not None:
+                self._wakeup.set()
+        else:
+            self.duplicates += 1
+        return inserted
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (0.5 + random() / 2)
+
+    async def _run(self, row):
+        job_id, kind, payload, attempts = row
+        job = Job(job_id, kind, codec.loads(payload), attempts, self)
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise PermanentError(f"No handler for job kind {kind!r}")
+            # Workers run outside any request, so each job is the root of its own trace
+            with tracing.span(f"job.{kind}", {"job.id": job_id, "job.attempt": attempts}):
+                await handler(job)
+        except asyncio.CancelledError:
+            # Shutdown: another worker picks the job up right away instead of after the lease
+            await self._call(self._release, job_id)
+            logs.info("jobs.released", job_id=job_id, kind=kind)
+            raise
+        except Exception as e:
+            permanent = isinstance(e, PermanentError) or attempts >= self.max_attempts
+            if permanent:
+                self.failed += 1
+                await self._call(self._finish, job_id, "failed", time(), repr(e))
+                logs.error("jobs.failed", job_id=job_id, kind=kind, attempts=attempts, error=repr(e))
+            else:
+                self.retried += 1
+                await self._call(self._finish, job_id, "pending", time() + self._backoff(attempts), repr(e))
+                logs.warning("jobs.retry", job_id=job_id, kind=kind, attempts=attempts, error=repr(e))
+        else:
+            self.succeeded += 1
+            await self._call(self._finish, job_id, "done", time(), None)
+
+    async def _worker(self):
+        while not self._stopping:
+            # Cleared before the claim, so an enqueue that lands while claiming is not missed
+            self._wakeup.clear()
+            try:
+                row = await self._call(self._claim)
+                if row is not None:
+                    await self._run(row)
+                    continue
+                if time() - self._last_purge > self.retention / 24:
+                    self._last_purge = time()
+                    await self._call(self._purge)
+            except Exception as e:
+                logs.error("jobs.worker_error", error=repr(e))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self._tasks:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Workers stop claiming and get shutdown_grace to finish the jobs they hold; jobs still running
+        # after that are cancelled and handed back as pending
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=self.shutdown_grace)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def stats(self):
+        return {
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "jobs": await self._call(self._counts)
+        }
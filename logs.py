@@ -0,0 +1,139 @@
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from random import random
+
+import codec
+
+log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+log_queue_size = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+max_field_chars = int(os.environ.get("LOG_MAX_FIELD_CHARS", "2000"))
+
+
+def _parse_sample_rates(value: str) -> dict[str, float]:
+    # LOG_SAMPLE_RATES="webhook.payload=0.01,asana.projects=0.1"
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+sample_rates = _parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))
+
+logger = logging.getLogger("asana_app")
+logger.propagate = False
+
+
+def _truncate(value):
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    elif not isinstance(value, (str, int, float, bool, type(None))):
+        try:
+            value = codec.dumps(value).decode()
+        except TypeError:
+            value = repr(value)
+    if isinstance(value, str) and len(value) > max_field_chars:
+        return f"{value[:max_field_chars]}...(+{len(value) - max_field_chars} chars)"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "event": record.getMessage()
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            entry[key] = _truncate(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return codec.dumps(entry).decode()
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Serialization and truncation happen on the listener thread, not in the request path
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: _DroppingQueueHandler | None = None
+_listener: QueueListener | None = None
+
+
+def setup():
+    global _handler, _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=log_queue_size))
+    logger.handlers = [_handler]
+    logger.setLevel(log_level)
+    _listener = QueueListener(_handler.queue, stream_handler)
+    _listener.start()
+
+
+def shutdown():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        # Anything logged after shutdown is written directly instead of queued for a listener that is gone
+        logger.handlers = list(_listener.handlers)
+        _listener = None
+
+
+def enabled(level, event) -> bool:
+    if not logger.isEnabledFor(level):
+        return False
+    rate = sample_rates.get(event, 1.0)
+    return rate >= 1.0 or random() < rate
+
+
+def log(level, event, **fields):
+    if enabled(level, event):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def debug(event, **fields):
+    log(logging.DEBUG, event, **fields)
+
+
+def info(event, **fields):
+    log(logging.INFO, event, **fields)
+
+
+def warning(event, **fields):
+    log(logging.WARNING, event, **fields)
+
+
+def error(event, **fields):
+    log(logging.ERROR, event, **fields)
+
+
+def payload(event, value, **fields):
+    # Debug-level payload dump; when debug is off or the event is sampled out nothing is serialized
+    if enabled(logging.DEBUG, event):
+        logger.debug(event, extra={"fields": dict(fields, payload=value)})
+
+
+def stats():
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0
+    }
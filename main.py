@@ -1,15 +1,15 @@
-import json
-import datetime
-import requests
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from fastapi import FastAPI, Request, HTTPException
 import hashlib
 import hmac
-from time import time
+from time import perf_counter, time
 
 import uvicorn
 import os
 import jwt
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 
 from dotenv import load_dotenv
 
@@ -18,10 +18,71 @@ load_dotenv()
 import mysql.connector
 from mysql.connector import Error
 
-db_password = os.environ.get("DB_PASSWORD")
-db_name = os.environ.get("DB_NAME")
+import asana_client
+import asana_directory
+import breaker
+import codec
+import db
+import http_client
+import jobs
+import logs
+import metrics
+import migrations
+import profiler
+import shared_cache
+import tracing
+import vault
+import views
+from asana_client import AsanaUnauthorized
+from breaker import CircuitOpen
+from cache import TTLCache
+from dispatcher import MessageDispatcher
+from replay import ReplayGuard
+from singleflight import SingleFlight
+from token_refresher import TokenRefresher
+
+
+logs.setup()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(db.init_pool)
+    await asyncio.to_thread(vault.get)
+    try:
+        await migrations.run()
+    except Exception as e:
+        # Everything below expects the latest schema, so a half-migrated database must not serve traffic
+        logs.error("db.migration_failed", error=str(e))
+        raise
+    if token_refresh_enabled:
+        token_refresher.start()
+    task_jobs.start()
+    yield
+    await task_jobs.stop()
+    await message_dispatcher.close()
+    await token_refresher.stop()
+    await http_client.close_clients()
+    await shared_cache.close()
+    db.close_pool()
+    tracing.shutdown()
+    logs.shutdown()
+
+
+production = os.environ.get("APP_ENV") == "production"
+
+app = FastAPI(debug=not production, trust_env=True, lifespan=lifespan)
+
+# Admin and *_stats endpoints are opt-in: they answer 404 until ADMIN_TOKEN is set, then require it in X-Admin-Token
+admin_token = os.environ.get("ADMIN_TOKEN")
+
+
+def require_admin(request: Request):
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
 
-app = FastAPI(debug=True, trust_env=True)
 
 # class SignatureVerifier:
 #     def __init__(self, signing_key: str, max_delay: int = 60 * 5, secret_version: str = "s0="):
@@ -54,7 +115,7 @@ max_delay = 60 * 5  # 5 minutes
 secret_version = "s0="
 
 
-def is_valid(body: str, timestamp: str | None, signature: str | None) -> bool:
+def is_valid(body: bytes, timestamp: str | None, signature: str | None) -> bool:
     if None in [timestamp, signature]:
         return False
 
@@ -64,93 +125,161 @@ def is_valid(body: str, timestamp: str | None, signature: str | None) -> bool:
     return False
 
 
+# A signed request is accepted from max_delay before its timestamp until max_delay after it,
+# so a replay of it can arrive up to 2 * max_delay after the first delivery
+webhook_replays = ReplayGuard(window=2 * max_delay)
+delivery_id_header = os.environ.get("WEBHOOK_DELIVERY_ID_HEADER")
+
+
 def _is_timestamp_valid(timestamp: str) -> bool:
     return abs(time() - int(timestamp)) <= max_delay
 
 
-def _generate_signature(body: str, timestamp: str) -> str:
-    base_string = f"swit:{timestamp}:{body}"
-    signature = hmac.new(signing_key, base_string.encode(), hashlib.sha256)
+def _generate_signature(body: bytes | str, timestamp: str) -> str:
+    if isinstance(body, str):
+        body = body.encode()
+    base_string = b"swit:" + timestamp.encode() + b":" + body
+    signature = hmac.new(signing_key, base_string, hashlib.sha256)
     return secret_version + signature.hexdigest()
 
 
-def create_db_connection():
+async def fetch_swit_token_from_db(user_id):
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password=db_password,
-            database=db_name
-        )
-        return connection
-    except Error as e:
-        print(f"The error '{e}' occurred")
+        result = await db.fetch_one("SELECT swit_token FROM userdata WHERE swit_id = %s", (user_id,))
+        return vault.decrypt(result[0], user_id, "swit_token") if result else None
+    except (Error, vault.VaultError) as e:
+        logs.error("db.query_error", user_id=user_id, error=str(e))
         return None
 
 
-def create_table():
-    connection = None
-    try:
-        connection = create_db_connection()
-        if connection is not None:
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                CREATE TABLE IF NOT EXISTS userdata (
-                    id INT AUTO_INCREMENT PRIMARY KEY, 
-                    swit_id VARCHAR(255), 
-                    asana_id VARCHAR(255), 
-                    asana_token TEXT, 
-                    asana_refresh_token VARCHAR(255),
-                    swit_token TEXT,
-                    swit_refresh_token VARCHAR(255)
-                )""")
-            connection.commit()
-    except Exception as e:
-        print(f"Failed to create table: {e}")
-    finally:
-        if connection and connection.is_connected():
-            connection.close()
+@dataclass(slots=True)
+class Credentials:
+    swit_token: str | None
+    swit_refresh_token: str | None
+    asana_token: str | None
+    asana_refresh_token: str | None
 
 
-def fetch_asana_token_from_db(user_id):
-    db_connection = create_db_connection()
-    if db_connection is None:
-        print("Database connection error")
-        return None
+credential_columns = ("swit_token", "swit_refresh_token", "asana_token", "asana_refresh_token")
+
 
+async def fetch_credentials_from_db(user_id) -> list | None:
+    # Returns the row still sealed by the vault, which is also what the shared cache holds, followed by
+    # the access token expiries so the cache TTL is known without unsealing
     try:
-        with db_connection.cursor(buffered=True) as cursor:
-            cursor.execute("SELECT asana_token FROM userdata WHERE swit_id = %s", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        result = await db.fetch_one(
+            "SELECT swit_token, swit_refresh_token, asana_token, asana_refresh_token, swit_expires_at, "
+            "asana_expires_at FROM userdata WHERE swit_id = %s",
+            (user_id,))
+        return list(result) if result else None
+    except db.PoolTimeout:
+        # Busy, not missing: the webhook answers "unavailable" instead of asking the user to sign in again
+        raise
     except Error as e:
-        print(f"Database query error: {e}")
+        logs.error("db.query_error", user_id=user_id, error=str(e))
         return None
-    finally:
-        if db_connection.is_connected():
-            db_connection.close()
 
 
-def fetch_swit_token_from_db(user_id):
-    db_connection = create_db_connection()
-    if db_connection is None:
-        print("Database connection error")
+def unseal_credentials(user_id, sealed) -> Credentials:
+    return Credentials(*(vault.decrypt(value, user_id, column) for value, column in
+                         zip(sealed[:len(credential_columns)], credential_columns)))
+
+
+credential_cache_size = int(os.environ.get("CREDENTIAL_CACHE_SIZE", "10000"))
+credential_cache_max_ttl = float(os.environ.get("CREDENTIAL_CACHE_MAX_TTL", "3600"))
+credential_cache_expiry_margin = float(os.environ.get("CREDENTIAL_CACHE_EXPIRY_MARGIN", "60"))
+credential_cache = TTLCache(max_size=credential_cache_size, default_ttl=credential_cache_max_ttl)
+# With a shared backend another worker may refresh a token, so the local copy is only kept briefly
+credential_cache_local_ttl = float(os.environ.get("CREDENTIAL_CACHE_LOCAL_TTL", "10"))
+# Bumped on every invalidation so a fill that read the row before it does not cache the old tokens.
+# Entries only need to outlive a fill, which the DB deadline bounds.
+credential_generations = TTLCache(max_size=credential_cache_size, default_ttl=300)
+
+
+def token_expiry(token: str | None, expires_in=None) -> int | None:
+    # The JWT exp claim, or for opaque tokens now + the expires_in the token endpoint returned with it
+    if not token:
+        return None
+    try:
+        return int(jwt.decode(token, options={"verify_signature": False})['exp'])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        pass
+    try:
+        return int(time() + float(expires_in))
+    except (TypeError, ValueError):
         return None
 
+
+def credentials_ttl(sealed) -> float:
+    # Drop the entry a little before the first access token expires so no cache tier serves a dead token.
+    # The stored expiries are the tokens' JWT exp, or expires_in for opaque tokens (see token_expiry).
+    expiries = [exp for exp in sealed[len(credential_columns):] if exp]
+    if not expiries:
+        return credential_cache_max_ttl
+    return min(min(expiries) - time() - credential_cache_expiry_margin, credential_cache_max_ttl)
+
+
+async def load_credentials(user_id) -> Credentials | None:
+    credentials = credential_cache.get(user_id)
+    if credentials is not None:
+        return credentials
+
+    generation = credential_generations.get(user_id, 0)
+    # The shared entry is keyed by a version that every token write bumps, so a worker that read the row
+    # before another worker's write stores the old tokens where no worker reads them
+    version = await shared_cache.version(f"credentials:{user_id}") if shared_cache.backend.shared else None
+    if version is None:
+        sealed = await fetch_credentials_from_db(user_id)
+    else:
+        sealed = await shared_cache.load_json(f"credentials:{user_id}:{version}", credentials_ttl,
+                                              lambda: fetch_credentials_from_db(user_id))
+    if sealed is None:
+        return None
+    # Decrypted once per local cache entry; cache hits reuse the plaintext
     try:
-        with db_connection.cursor(buffered=True) as cursor:
-            cursor.execute("SELECT swit_token FROM userdata WHERE swit_id = %s", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
-    except Error as e:
-        print(f"Database query error: {e}")
+        credentials = unseal_credentials(user_id, sealed)
+    except vault.VaultError as e:
+        # One unreadable row must not fail the webhook; the user signs in again, which rewrites it
+        logs.error("vault.credentials_unreadable", user_id=user_id, error=str(e))
         return None
-    finally:
-        if db_connection.is_connected():
-            db_connection.close()
+    if credential_generations.get(user_id, 0) != generation:
+        # Invalidated while loading: use the row for this request only
+        return credentials
+    ttl = credentials_ttl(sealed)
+    if shared_cache.backend.shared:
+        ttl = min(ttl, credential_cache_local_ttl)
+    credential_cache.set(user_id, credentials, ttl)
+    return credentials
+
+
+def invalidate_local_credentials(user_id):
+    credential_generations.set(user_id, credential_generations.get(user_id, 0) + 1)
+    credential_cache.invalidate(user_id)
+
+
+async def invalidate_credentials(user_id):
+    # Called after every token write
+    invalidate_local_credentials(user_id)
+    await shared_cache.bump(f"credentials:{user_id}")
+
+
+@app.get("/cache_stats")
+async def cache_stats(request: Request):
+    require_admin(request)
+    return {
+        "credentials": credential_cache.stats(),
+        "shared": shared_cache.stats(),
+        "webhook_replays": webhook_replays.stats(),
+        "asana_directory": asana_directory.directory.stats()
+    }
+
+
+@app.get("/db_pool_stats")
+async def db_pool_stats(request: Request):
+    require_admin(request)
+    return db.pool_stats()
 
 
-swit_app_id = os.environ.get("SWIT_APP_ID")
 swit_client_id = os.environ.get("SWIT_CLIENT_ID")
 swit_client_secret = os.environ.get("SWIT_CLIENT_SECRET")
 redirect_uri = os.environ.get("SWIT_REDIRECT_URI")
@@ -159,6 +288,12 @@ asana_client_id = os.environ.get("ASANA_CLIENT_ID")
 asana_client_secret = os.environ.get("ASANA_CLIENT_SECRET")
 swit_api_url = os.environ.get("SWIT_API_URL")
 
+swit_api_circuit = breaker.register("swit_api", float(os.environ.get("SWIT_API_TIMEOUT", "10")))
+swit_oauth_circuit = breaker.register("swit_oauth", float(os.environ.get("SWIT_OAUTH_TIMEOUT", "10")))
+
+# Raised when a dependency is down or too slow; handlers answer right away instead of waiting on it
+unavailable_errors = (CircuitOpen, asyncio.TimeoutError, db.PoolTimeout)
+
 
 @app.get("/")
 async def root():
@@ -180,88 +315,9 @@ def initiate_oauth_flow(user_id: str, action: str, user_language: str, channel_i
     scope = "app:install+channel:write+channel:read+message:read+message:write+message:read+project:read+project:write+task:read+task:write"
     swit_authorize_url = swit_api_url + "oauth/authorize"
     oauth_url = f"{swit_authorize_url}?client_id={swit_client_id}&redirect_uri={redirect_uri}&response_type=code&state={state}&scope={scope}"
+    metrics.oauth_redirects.inc()
     # oauth_url = "https://urt.swit.fun/sarah/app_install?app_name=asana_sarah&user_id=" + user_id
-    return {
-        "callback_type": "views.open",
-        "new_view": {
-            "view_id": "builder_test",
-            "state": action + ":" + channel_id,
-            "header": {
-                "title": "Connect to Asana",
-                "buttons": [
-                    {
-                        "type": "button",
-                        "icon": {
-                            "type": "image",
-                            "image_url": "./assets/builder_logo.png",
-                            "alt": "Header button icon"
-                        },
-                        "static_action": {
-                            "action_type": "open_link",
-                            "link_url": "https://swit.io"
-                        }
-                    }
-                ]
-            },
-            "body": {
-                "elements": [
-                    {
-                        "type": "sign_in_page",
-                        "title": "Try Asana for Swit",
-                        "description": "Sign in to start using Asana in Swit.",
-                        "button": {
-                            "type": "button",
-                            "label": "Sign in",
-                            "action_id": "asana_oauth_button",
-                            "static_action": {
-                                "action_type": "open_oauth_popup",
-                                "link_url": oauth_url
-                            }
-                        },
-                        "integrated_service": {
-                            "icon": {
-                                "type": "image",
-                                "image_url": "https://files.swit.io/data/assets/apps/23092108333670VJ6MRS/23103004371942AFKL5P.jpg"
-                            }
-                        }
-                    }
-                ]
-            }
-        }
-    }
-
-
-# def get_token_from_file(token_lifetime_in_seconds=0, token_type="swit_token"):
-#     file_path = "token.json"
-#
-#     if not os.path.exists(file_path):
-#         # If the token file does not exist, return None
-#         return None
-#     with open(file_path, "r") as f:
-#         token_data = json.load(f)
-#
-#     swit_token = token_data['access_token']
-#
-#     return swit_token
-#
-#
-#
-#     # Examines the expiration time of the access token
-#     access_token_parsed = jwt.decode(token, options={"verify_signature": False})
-#     exp = access_token_parsed['exp']
-#     if is_timestamp_earlier_than_future(exp, token_lifetime_in_seconds):
-#         return token + "invalid"
-#     else:
-#         return token
-#
-#
-# def is_timestamp_earlier_than_future(timestamp, token_lifetime_in_seconds):
-#     # Convert the provided timestamp to a datetime object
-#     provided_time = datetime.datetime.fromtimestamp(int(timestamp))
-#     future_time = datetime.datetime.now() + datetime.timedelta(days=7, seconds=(token_lifetime_in_seconds * -1))
-#
-#     # Check if the provided time is earlier than the future time
-#     return provided_time < future_time
+    return views.oauth_view.response(state=action + ":" + channel_id, oauth_url=oauth_url)
 
 
 @app.get("/oauth")
@@ -276,11 +332,15 @@ async def oauth(code, state):
         "redirect_uri": redirect_uri,
         "code": swit_code
     }
-    swit_response = requests.post(swit_token_url, headers=swit_headers, data=swit_payload)
-
-    if not swit_response.ok:
-        print("Failed to obtain access token. Status code:", swit_response.status_code)
-        print("Response:", swit_response.text)
+    try:
+        swit_response = await swit_oauth_circuit.call(http_client.post, swit_token_url, headers=swit_headers,
+                                                      data=swit_payload)
+    except unavailable_errors as e:
+        logs.error("swit.oauth_unavailable", error=repr(e))
+        return {"error": "Swit is temporarily unavailable"}
+
+    if not swit_response.is_success:
+        logs.error("swit.oauth_token_failed", status_code=swit_response.status_code, response=swit_response.text)
         return {"error": "Failed to obtain access token"}
 
     if state == "hello":
@@ -300,44 +360,39 @@ async def oauth(code, state):
         response_json = swit_response.json()
         swit_token = response_json['access_token']
         swit_refresh_token = response_json.get('refresh_token', '')
+        swit_expires_at = token_expiry(swit_token, response_json.get('expires_in'))
 
         # Store swit_token in the database
-        db_connection = create_db_connection()
-        if db_connection is None:
-            return {"error": "Database connection error"}
-
         try:
             query = """
-                                INSERT INTO userdata (swit_id, swit_token, swit_refresh_token) 
-                                VALUES (%s, %s, %s) 
+                                INSERT INTO userdata (swit_id, swit_token, swit_refresh_token, swit_expires_at) 
+                                VALUES (%s, %s, %s, %s) 
                                 ON DUPLICATE KEY UPDATE 
                                 swit_token = VALUES(swit_token), 
-                                swit_refresh_token = VALUES(swit_refresh_token)
+                                swit_refresh_token = VALUES(swit_refresh_token),
+                                swit_expires_at = VALUES(swit_expires_at),
+                                swit_refresh_failures = 0
                             """
-            values = (user_id, swit_token, swit_refresh_token)
-
-            with db_connection.cursor() as cursor:
-                cursor.execute(query, values)
-                db_connection.commit()
+            values = (user_id, vault.encrypt(swit_token, user_id, "swit_token"),
+                      vault.encrypt(swit_refresh_token, user_id, "swit_refresh_token"), swit_expires_at)
+            await db.execute(query, values)
+            await invalidate_credentials(user_id)
         except Error as e:
-            print(f"Database error: {e}")
+            logs.error("db.write_error", user_id=user_id, error=str(e))
             return {"error": "Database operation failed"}
-        finally:
-            if db_connection and db_connection.is_connected():
-                db_connection.close()
 
-            asana_authorize_url = "https://app.asana.com/-/oauth_authorize"
-            asana_oauth_url = f"{asana_authorize_url}?client_id={asana_client_id}&redirect_uri={asana_redirect_uri}&response_type=code&state={state}&scope=default"
-            return RedirectResponse(url=asana_oauth_url)
+        asana_authorize_url = asana_client.oauth_authorize_url
+        asana_oauth_url = f"{asana_authorize_url}?client_id={asana_client_id}&redirect_uri={asana_redirect_uri}&response_type=code&state={state}&scope=default"
+        return RedirectResponse(url=asana_oauth_url)
     except Exception as e:
-        print(f"General error: {e}")
+        logs.error("swit.oauth_failed", error=str(e))
         return {"error": "General error"}
 
 
 @app.get("/asana_oauth")
 async def asana_oauth(code, state):
     user_id, action, user_language, channel_id = state.split(":")
-    asana_token_url = "https://app.asana.com/-/oauth_token"
+    asana_token_url = asana_client.oauth_token_url
     asana_payload = {
         "grant_type": "authorization_code",
         "client_id": asana_client_id,
@@ -345,40 +400,40 @@ async def asana_oauth(code, state):
         "redirect_uri": asana_redirect_uri,
         "code": code
     }
-    asana_response = requests.post(asana_token_url, data=asana_payload)
+    try:
+        asana_response = await asana_client.request("POST", asana_token_url, data=asana_payload)
+    except unavailable_errors as e:
+        logs.error("asana.oauth_unavailable", error=repr(e))
+        return {"error": "Asana is temporarily unavailable"}
 
-    if asana_response.ok:
+    if asana_response.is_success:
         asana_token_data = asana_response.json()
         asana_token = asana_token_data['access_token']
         asana_refresh_token = asana_token_data['refresh_token']
         asana_id = asana_token_data['data']['gid']
-
-        db_connection = create_db_connection()
-        if db_connection is None:
-            return {"error": "Database connection error"}
+        asana_expires_at = token_expiry(asana_token, asana_token_data.get('expires_in'))
 
         try:
             query = """
                                UPDATE userdata SET
                                asana_id = %s, 
                                asana_token = %s, 
-                               asana_refresh_token = %s
+                               asana_refresh_token = %s,
+                               asana_expires_at = %s,
+                               asana_refresh_failures = 0
                                WHERE swit_id = %s
                            """
-            values = (asana_id, asana_token, asana_refresh_token, user_id)
-            with db_connection.cursor() as cursor:
-                cursor.execute(query, values)
-                db_connection.commit()
-
+            values = (asana_id, vault.encrypt(asana_token, user_id, "asana_token"),
+                      vault.encrypt(asana_refresh_token, user_id, "asana_refresh_token"), asana_expires_at,
+                      user_id)
+            await db.execute(query, values)
+            await invalidate_credentials(user_id)
+            await asana_directory.invalidate_user(user_id)
         except Error as e:
-            print(f"Database error: {e}")
+            logs.error("db.write_error", user_id=user_id, error=str(e))
             return {"error": "Database operation failed"}
 
-        finally:
-            if db_connection and db_connection.is_connected():
-                db_connection.close()
-
-        swit_token = fetch_swit_token_from_db(user_id)
+        swit_token = await fetch_swit_token_from_db(user_id)
 
         if action == 'asana_help':
             await help_message(user_id, user_language, channel_id, swit_token)
@@ -405,142 +460,246 @@ async def asana_oauth(code, state):
                             """
             return HTMLResponse(content=html_content)
     else:
-        print("Failed to obtain Asana token. Status code:", asana_response.status_code)
-        print("Response:", asana_response.text)
+        logs.error("asana.oauth_token_failed", status_code=asana_response.status_code, response=asana_response.text)
         return {"error": "Failed to obtain Asana token"}
 
 
+token_refresh_flight = SingleFlight()
+
+
+token_refresh_lock_ttl = float(os.environ.get("TOKEN_REFRESH_LOCK_TTL", "30"))
+
+
 async def refresh_swit_token(user_id):
-    db_connection = None
-    try:
-        db_connection = create_db_connection()
-        if db_connection is None:
-            raise Exception("Database connection could not be established")
-
-        with db_connection.cursor() as cursor:
-            cursor.execute("SELECT swit_refresh_token FROM userdata WHERE swit_id = %s", (user_id,))
-            result = cursor.fetchone()
-            if not result:
-                raise Exception(f"No Swit refresh token found for user: {user_id}")
-            swit_refresh_token = result[0]
-
-            token_url = swit_api_url + "oauth/token"
-            headers = {"Content-Type": "application/x-www-form-urlencoded"}
-            payload = {
-                "grant_type": "refresh_token",
-                "client_id": swit_client_id,
-                "client_secret": swit_client_secret,
-                "refresh_token": swit_refresh_token
-            }
+    return await token_refresh_flight.do(("swit", user_id), _refresh_across_workers, "swit", user_id,
+                                         _refresh_swit_token)
 
-            response = requests.post(token_url, headers=headers, data=payload)
 
-            if response.ok:
-                new_token_info = response.json()
-                new_swit_token = new_token_info['access_token']
-                new_swit_refresh_token = new_token_info['refresh_token']
+async def refresh_asana_token(user_id):
+    return await token_refresh_flight.do(("asana", user_id), _refresh_across_workers, "asana", user_id,
+                                         _refresh_asana_token)
 
-                update_query = """
-                                UPDATE userdata SET
-                                swit_token = %s, 
-                                swit_refresh_token = %s
-                                WHERE swit_id = %s
-                            """
-                update_values = (new_swit_token, new_swit_refresh_token, user_id)
-                cursor.execute(update_query, update_values)
-                db_connection.commit()
-                print("Token refreshed successfully")
-                return new_swit_token
-            else:
-                print("Failed to refresh token. Status code:", response.status_code)
-                return False
+
+async def _refresh_across_workers(kind, user_id, refresh):
+    # Refresh tokens are single use, so only one worker may spend one; the others wait for it and take
+    # its outcome: the token it stored, its failure, or its outage
+    lock_key = f"token_refresh:{kind}:{user_id}"
+    outcome_key = f"token_refresh_outcome:{kind}:{user_id}"
+    if await shared_cache.add(lock_key, token_refresh_lock_ttl):
+        outcome = None
+        try:
+            # Waiters only read the outcome once the lock is gone, so none sees an earlier refresh's
+            await shared_cache.delete(outcome_key)
+            token = await refresh(user_id)
+            outcome = b"refreshed" if token else b"failed"
+            return token
+        except unavailable_errors:
+            outcome = b"unavailable"
+            raise
+        finally:
+            if outcome is not None:
+                await shared_cache.put(outcome_key, token_refresh_lock_ttl, outcome)
+            await shared_cache.delete(lock_key)
+
+    deadline = time() + token_refresh_lock_ttl
+    while time() < deadline and await shared_cache.exists(lock_key):
+        await asyncio.sleep(0.1)
+    outcome = await shared_cache.get(outcome_key)
+    if outcome == b"failed":
+        # The stored token is the one that was just rejected
+        return False
+    if outcome != b"refreshed":
+        # The refresh hit an outage, or its worker went away without an answer: retry later
+        # rather than send the user through OAuth again
+        raise CircuitOpen(f"{kind}_token_refresh")
+    invalidate_local_credentials(user_id)
+    credentials = await load_credentials(user_id)
+    token = getattr(credentials, f"{kind}_token", None) if credentials else None
+    return token or False
+
+
+async def _refresh_swit_token(user_id):
+    try:
+        result = await db.fetch_one("SELECT swit_refresh_token FROM userdata WHERE swit_id = %s", (user_id,))
+        if not result:
+            raise Exception(f"No Swit refresh token found for user: {user_id}")
+        swit_refresh_token = vault.decrypt(result[0], user_id, "swit_refresh_token")
+
+        token_url = swit_api_url + "oauth/token"
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        payload = {
+            "grant_type": "refresh_token",
+            "client_id": swit_client_id,
+            "client_secret": swit_client_secret,
+            "refresh_token": swit_refresh_token
+        }
+
+        response = await swit_oauth_circuit.call(http_client.post, token_url, headers=headers, data=payload)
+
+        if response.is_success:
+            new_token_info = response.json()
+            new_swit_token = new_token_info['access_token']
+            new_swit_refresh_token = new_token_info['refresh_token']
+
+            update_query = """
+                            UPDATE userdata SET
+                            swit_token = %s, 
+                            swit_refresh_token = %s,
+                            swit_expires_at = %s,
+                            swit_refresh_failures = 0
+                            WHERE swit_id = %s
+                        """
+            update_values = (vault.encrypt(new_swit_token, user_id, "swit_token"),
+                             vault.encrypt(new_swit_refresh_token, user_id, "swit_refresh_token"),
+                             token_expiry(new_swit_token, new_token_info.get('expires_in')), user_id)
+            await db.execute(update_query, update_values)
+            await invalidate_credentials(user_id)
+            logs.info("swit.token_refreshed", user_id=user_id)
+            return new_swit_token
+        else:
+            logs.error("swit.token_refresh_failed", user_id=user_id, status_code=response.status_code)
+            return False
+    except unavailable_errors:
+        # Not a revoked token; the caller fails fast instead of sending the user back through OAuth
+        raise
     except mysql.connector.Error as e:
-        print(f"Database error: {e}")
+        logs.error("db.query_error", user_id=user_id, error=str(e))
         return False
     except Exception as e:
-        print(f"General error: {e}")
+        logs.error("token_refresh.error", user_id=user_id, error=str(e))
         return False
-    finally:
-        if isinstance(db_connection, mysql.connector.connection.MySQLConnection):
-            if db_connection.is_connected():
-                db_connection.close()
 
 
-async def refresh_asana_token(user_id):
-    db_connection = None
+async def _refresh_asana_token(user_id):
     try:
-        db_connection = create_db_connection()
-        if db_connection is None:
-            raise Exception("Database connection could not be established")
-
-        with db_connection.cursor() as cursor:
-            cursor.execute("SELECT asana_refresh_token FROM userdata WHERE swit_id = %s", (user_id,))
-            result = cursor.fetchone()
-            if not result:
-                raise Exception(f"No Asana refresh token found for user: {user_id}")
-            asana_refresh_token = result[0]
-
-            token_url = "https://app.asana.com/-/oauth_token"
-            payload = {
-                "grant_type": "refresh_token",
-                "client_id": asana_client_id,
-                "client_secret": asana_client_secret,
-                "refresh_token": asana_refresh_token
-            }
-
-            response = requests.post(token_url, data=payload)
-
-            if response.ok:
-                new_token_info = response.json()
-                new_asana_token = new_token_info['access_token']
-                new_asana_refresh_token = new_token_info.get('refresh_token', asana_refresh_token)
+        result = await db.fetch_one("SELECT asana_refresh_token FROM userdata WHERE swit_id = %s", (user_id,))
+        if not result:
+            raise Exception(f"No Asana refresh token found for user: {user_id}")
+        asana_refresh_token = vault.decrypt(result[0], user_id, "asana_refresh_token")
+
+        token_url = asana_client.oauth_token_url
+        payload = {
+            "grant_type": "refresh_token",
+            "client_id": asana_client_id,
+            "client_secret": asana_client_secret,
+            "refresh_token": asana_refresh_token
+        }
 
-                update_query = """
-                                UPDATE userdata SET
-                                asana_token = %s, 
-                                asana_refresh_token = %s
-                                WHERE swit_id = %s
-                            """
-                update_values = (new_asana_token, new_asana_refresh_token, user_id)
-                cursor.execute(update_query, update_values)
-                db_connection.commit()
-                return new_asana_token
-            else:
-                print("Failed to refresh Asana token. Status code:", response.status_code)
-                return False
+        response = await asana_client.request("POST", token_url, data=payload)
+
+        if response.is_success:
+            new_token_info = response.json()
+            new_asana_token = new_token_info['access_token']
+            new_asana_refresh_token = new_token_info.get('refresh_token', asana_refresh_token)
+
+            update_query = """
+                            UPDATE userdata SET
+                            asana_token = %s, 
+                            asana_refresh_token = %s,
+                            asana_expires_at = %s,
+                            asana_refresh_failures = 0
+                            WHERE swit_id = %s
+                        """
+            update_values = (vault.encrypt(new_asana_token, user_id, "asana_token"),
+                             vault.encrypt(new_asana_refresh_token, user_id, "asana_refresh_token"),
+                             token_expiry(new_asana_token, new_token_info.get('expires_in')), user_id)
+            await db.execute(update_query, update_values)
+            await invalidate_credentials(user_id)
+            return new_asana_token
+        else:
+            logs.error("asana.token_refresh_failed", user_id=user_id, status_code=response.status_code)
+            return False
+    except unavailable_errors:
+        # Not a revoked token; the caller fails fast instead of sending the user back through OAuth
+        raise
     except mysql.connector.Error as e:
-        print(f"Database error: {e}")
+        logs.error("db.query_error", user_id=user_id, error=str(e))
         return False
     except Exception as e:
-        print(f"General error: {e}")
+        logs.error("token_refresh.error", user_id=user_id, error=str(e))
         return False
-    finally:
-        if isinstance(db_connection, mysql.connector.connection.MySQLConnection):
-            if db_connection.is_connected():
-                db_connection.close()
 
 
-async def help_message(user_id, user_language, channel_id, swit_token):
-    help_content = ""
-    if user_language == 'ko':
-        help_content = "{\"type\":\"rich_text\",\"elements\":[{\"type\":\"rt_section\",\"elements\":[{\"type\":\"rt_mention\",\"user_id\":\"" + user_id + "\"},{\"type\":\"rt_text\",\"content\":\" 안녕하세요. Swit에서 Asana앱을 사용하여 업무를 관리해 보세요.\\n\"},{\"type\":\"rt_text\",\"content\":\"사용 가능한 커맨드\",\"styles\":{\"bold\":true}}]},{\"type\":\"rt_blockquote\",\"elements\":[{\"type\":\"rt_text\",\"content\":\"/asana_create\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" 새 업무 생성.\\n\"},{\"type\":\"rt_text\",\"content\":\"/asana_link\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" 아사나 링크.\\n\"},{\"type\":\"rt_text\",\"content\":\"/asana_settings\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" 설정 보기.\\n\"},{\"type\":\"rt_text\",\"content\":\"/asana_help\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" 도움말.\"}]},{\"type\":\"rt_section\",\"elements\":[{\"type\":\"rt_text\",\"content\":\"문의\",\"styles\":{\"bold\":true}}]},{\"type\":\"rt_blockquote\",\"elements\":[{\"type\":\"rt_link\",\"content\":\"문의 링크\",\"url\":\"https://help.swit.io/?support=true\"}]}]}"
-    elif user_language == 'en':
-        help_content = "{\"type\":\"rich_text\",\"elements\":[{\"type\":\"rt_section\",\"elements\":[{\"type\":\"rt_text\",\"content\":\"Hello \"},{\"type\":\"rt_mention\",\"user_id\":\"" + user_id + "\"},{\"type\":\"rt_text\",\"content\":\", here are some ways you can use Asana for Swit to manage your work.\\n\"},{\"type\":\"rt_text\",\"content\":\"Available commands\",\"styles\":{\"bold\":true}}]},{\"type\":\"rt_blockquote\",\"elements\":[{\"type\":\"rt_text\",\"content\":\"Use \"},{\"type\":\"rt_text\",\"content\":\"/asana_create\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" to create a new task. You can add text after the command to pre-fill the task name.\\nUse \"},{\"type\":\"rt_text\",\"content\":\"/asana_link\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" in a channel to manage the channel’s linked project notifications or to link a new project.\\nUse \"},{\"type\":\"rt_text\",\"content\":\"/asana_settings\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" to manage your personal notifications settings and default Asana domain.\\nUse \"},{\"type\":\"rt_text\",\"content\":\"/asana_help\",\"styles\":{\"code\":true}},{\"type\":\"rt_text\",\"content\":\" to see this message again.\"}]},{\"type\":\"rt_section\",\"elements\":[{\"type\":\"rt_text\",\"content\":\"Support\",\"styles\":{\"bold\":true}}]},{\"type\":\"rt_blockquote\",\"elements\":[{\"type\":\"rt_link\",\"content\":\"Contact us\",\"url\":\"https://help.swit.io/?support=true\"},{\"type\":\"rt_text\",\"content\":\".\"}]}]}"
+token_refresh_enabled = os.environ.get("TOKEN_REFRESH_ENABLED", "1") != "0"
+# Tokens that expired longer ago than this belong to dormant users and are refreshed on their next webhook
+token_refresh_max_age = float(os.environ.get("TOKEN_REFRESH_MAX_AGE", str(7 * 24 * 3600)))
+token_refresh_max_failures = int(os.environ.get("TOKEN_REFRESH_MAX_FAILURES", "3"))
+expiry_columns = {"swit": "swit_expires_at", "asana": "asana_expires_at"}
+failure_columns = {"swit": "swit_refresh_failures", "asana": "asana_refresh_failures"}
+
+
+async def fetch_due_tokens(kind, deadline, after_id, limit):
+    return await db.fetch_all(
+        f"SELECT id, swit_id FROM userdata WHERE {expiry_columns[kind]} BETWEEN %s AND %s "
+        f"AND {failure_columns[kind]} < %s AND id > %s ORDER BY id LIMIT %s",
+        (int(time() - token_refresh_max_age), deadline, token_refresh_max_failures, after_id, limit))
+
+
+async def record_refresh_failure(kind, user_id):
+    # Reset whenever a new token is stored, by OAuth or by a refresh triggered from a webhook
+    await db.execute(f"UPDATE userdata SET {failure_columns[kind]} = {failure_columns[kind]} + 1 WHERE swit_id = %s",
+                     (user_id,))
+
+
+token_refresher = TokenRefresher(
+    fetch_due_tokens,
+    {"swit": refresh_swit_token, "asana": refresh_asana_token},
+    record_refresh_failure,
+    interval=float(os.environ.get("TOKEN_REFRESH_INTERVAL", "60")),
+    horizon=float(os.environ.get("TOKEN_REFRESH_HORIZON", "300")),
+    batch_size=int(os.environ.get("TOKEN_REFRESH_BATCH_SIZE", "500")),
+    concurrency=int(os.environ.get("TOKEN_REFRESH_CONCURRENCY", "8")),
+    leader=lambda: shared_cache.add("token_refresh:leader", token_refresher.interval * 0.9)
+)
+
+
+@app.get("/token_refresh_stats")
+async def token_refresh_stats(request: Request):
+    require_admin(request)
+    return {
+        "scheduler": token_refresher.stats(),
+        "single_flight": token_refresh_flight.stats()
+    }
 
+
+async def post_swit_message(channel_id, swit_token, content):
     url = swit_api_url + "v1/api/message.create"
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json",
         "Authorization": f"Bearer {swit_token}"
     }
-    body = {
-        "channel_id": channel_id,
-        "content": help_content,
-        "body_type": "json_string"
-    }
+    if not isinstance(content, str):
+        content = codec.dumps(content).decode()
+    body = views.message_body.render_bytes(channel_id=channel_id, content=content)
+    return await swit_api_circuit.call(http_client.post, url, headers=headers, content=body)
+
+
+message_dispatcher = MessageDispatcher(
+    post_swit_message,
+    rate=float(os.environ.get("SWIT_MESSAGE_RATE", "5")),
+    burst=int(os.environ.get("SWIT_MESSAGE_BURST", "10")),
+    linger=float(os.environ.get("SWIT_MESSAGE_LINGER", "0.05")),
+    max_batch=int(os.environ.get("SWIT_MESSAGE_MAX_BATCH", "10"))
+)
+
+
+@app.get("/message_dispatch_stats")
+async def message_dispatch_stats(request: Request):
+    require_admin(request)
+    return message_dispatcher.stats()
 
-    response = requests.post(url=url, headers=headers, json=body)
-    print(response.text)
+
+async def help_message(user_id, user_language, channel_id, swit_token):
+    help_template = views.help_contents.get(user_language)
+    help_content = help_template.render(user_id=user_id) if help_template else ""
+
+    started = perf_counter()
+    try:
+        response = await message_dispatcher.submit(channel_id, swit_token, help_content)
+    finally:
+        metrics.swit_help_message_seconds.observe(perf_counter() - started)
+    logs.payload("swit.message_response", response.content, channel_id=channel_id)
     # if response.status_code == 401:
     #     # Token refresh
     #     swit_new_token = await refresh_swit_token(user_id)
@@ -555,199 +714,117 @@ async def help_message(user_id, user_language, channel_id, swit_token):
     #     }
 
 
+create_task_timeout = float(os.environ.get("CREATE_TASK_TIMEOUT", "3"))
+create_task_max_options = int(os.environ.get("CREATE_TASK_MAX_OPTIONS", "200"))
+
+
+async def _asana_workspace_id(user_id, asana_token):
+    started = perf_counter()
+    try:
+        workspaces = await asana_directory.workspaces(user_id, asana_token)
+        return workspaces[0]['workspace']['gid']
+    finally:
+        metrics.asana_workspaces_seconds.observe(perf_counter() - started)
+
+
+async def _asana_project_index(user_id, asana_token, workspace_call=None):
+    workspace_id = await (workspace_call or _asana_workspace_id(user_id, asana_token))
+    started = perf_counter()
+    try:
+        return await asana_directory.project_index(workspace_id, user_id, asana_token)
+    finally:
+        metrics.asana_projects_seconds.observe(perf_counter() - started)
+
+
+async def _asana_member_index(user_id, asana_token, workspace_call=None):
+    workspace_id = await (workspace_call or _asana_workspace_id(user_id, asana_token))
+    started = perf_counter()
+    try:
+        return await asana_directory.member_index(workspace_id, asana_token)
+    finally:
+        metrics.asana_members_seconds.observe(perf_counter() - started)
+
+
+def _asana_call_options(call, name):
+    # Calls that timed out or failed leave their dropdown empty instead of failing the whole modal
+    if not call.done() or call.cancelled():
+        logs.warning("asana.lookup_timeout", lookup=name)
+        return []
+    if call.exception() is not None:
+        logs.error("asana.lookup_failed", lookup=name, error=str(call.exception()))
+        return []
+    return call.result().options[:create_task_max_options]
+
+
 async def create_task(user_id, channel_id, asana_token, pre_filled_message):
     if not asana_token:
-        print("No Asana token found for the user.")
+        logs.warning("asana.token_missing", user_id=user_id)
         return None
 
-    # Get project list
-    url = "https://app.asana.com/api/1.0/projects"
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": f"Bearer {asana_token}"
-    }
-    response = requests.get(url=url, headers=headers)
+    # Project and member options come from the directory cache; on a miss both lookups run concurrently
+    # once the workspace lookup they share is done, and each has its own stage in webhook_stage_seconds
+    workspace_call = asyncio.create_task(_asana_workspace_id(user_id, asana_token))
+    projects_call = asyncio.create_task(_asana_project_index(user_id, asana_token, workspace_call))
+    members_call = asyncio.create_task(_asana_member_index(user_id, asana_token, workspace_call))
+    calls = (projects_call, members_call)
 
-    if response.status_code == 401:
+    done, pending = await asyncio.wait(calls, timeout=create_task_timeout)
+    for call in pending:
+        call.cancel()
+
+    if all(call in done and isinstance(call.exception(), CircuitOpen) for call in calls):
+        return views.unavailable_view.response()
+
+    if any(call in done and isinstance(call.exception(), AsanaUnauthorized) for call in calls):
         # Token refresh
+        metrics.token_refreshes.get("asana").inc()
         asana_new_token = await refresh_asana_token(user_id)
         if asana_new_token:
             return await create_task(user_id, channel_id, asana_new_token, pre_filled_message)
         else:
             return initiate_oauth_flow(user_id, "asana_create", "ko", channel_id)
 
-    projects = response.json()['data']
-    print(json.dumps(projects, indent=2))
-
-    # sarah_test = [
-    #     {
-    #         "label": project['name'],
-    #         "action_id": project['gid']
-    #     } for project in projects
-    # ]
-
-    sarah_test = []
-    for project in projects:
-        project_dict = {
-            "label": project['name'],
-            "action_id": project['gid']
-        }
-        sarah_test.append(project_dict)
+    sarah_test = _asana_call_options(projects_call, "projects")
+    assignee_test = [{"label": "Unassigned", "value": "unassigned"}, *_asana_call_options(members_call, "members")]
 
-    ## Get workspace member list
-    workspace_url = "https://app.asana.com/api/1.0/users/me/workspace_memberships"
+    return views.create_task_view.response(
+        channel_id=channel_id,
+        pre_filled_message=pre_filled_message if pre_filled_message else None,
+        assignee_options=assignee_test,
+        project_options=sarah_test
+    )
 
-    workspace_headers = {
-        "accept": "application/json",
-        "authorization": f"Bearer {asana_token}"
-    }
 
-    response = requests.get(url=workspace_url, headers=workspace_headers)
-    workspaces = response.json()['data']
-    print(json.dumps(workspaces, indent=2))
+asana_search_limit = int(os.environ.get("ASANA_SEARCH_LIMIT", "20"))
 
-    workspace_id = workspaces[0]['workspace']['gid']
-    user_url = f"https://app.asana.com/api/1.0/workspaces/{workspace_id}/workspace_memberships"
 
-    user_headers = {
-        "accept": "application/json",
-        "authorization": f"Bearer {asana_token}"
-    }
-    response = requests.get(url=user_url, headers=user_headers)
-
-    members = response.json()['data']
-    print(json.dumps(members, indent=2))
-
-    assignee_test = [
-        {
-            "label": member['user']['name'],
-            "action_id": member['user']['gid']
-        } for member in members
-    ]
-
-    unassigned_option = {"label": "Unassigned", "value": "unassigned"}
-    assignee_test.insert(0, unassigned_option)
-
-    create_modal = {
-        "callback_type": "views.open",
-        "new_view": {
-            "view_id": "asana_create_view",
-            "state": channel_id,
-            "header": {
-                "title": "Create a new task",
-                "subtitle": "in Asana",
-                "buttons": [
-                    {
-                        "type": "button",
-                        "icon": {
-                            "type": "image",
-                            "image_url": "./assets/builder_logo.png",
-                            "alt": "Header button icon"
-                        },
-                        "static_action": {
-                            "action_type": "open_link",
-                            "link_url": "https://swit.io"
-                        }
-                    }
-                ]
-            },
-            "body": {
-                "elements": [
-                    {
-                        "type": "text",
-                        "markdown": True,
-                        "content": "**Task name**"
-                    },
-                    {
-                        "type": "text_input",
-                        "action_id": "asana_task_name",
-                        "placeholder": "Write a task name",
-                        "trigger_on_input": False
-                    },
-                    {
-                        "type": "text",
-                        "markdown": True,
-                        "content": "**Task description**"
-                    },
-                    {
-                        "type": "textarea",
-                        "action_id": "task_description",
-                        "placeholder": "Write a task description",
-                        "value": pre_filled_message if pre_filled_message else None,
-                        "height": "small",
-                        "disabled": False
-                    },
-                    {
-                        "type": "text",
-                        "markdown": True,
-                        "content": "**Assignee**"
-                    },
-                    {
-                        "type": "select",
-                        "options": assignee_test,
-                        "placeholder": "Select an assignee",
-                        "multiselect": False,
-                        "trigger_on_input": False,
-                        "query": {
-                            "query_server": True,
-                            "disabled": True,
-                            "placeholder": "Search by member name",
-                            "value": None,
-                            "action_id": "asana_assignee_select"
-                        },
-                        "style": {
-                            "variant": "outlined"
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "markdown": True,
-                        "content": "**Project**"
-                    },
-                    {
-                        "type": "select",
-                        "placeholder": "Select a project",
-                        "multiselect": False,
-                        "trigger_on_input": False,
-                        "options": sarah_test,
-                        "style": {
-                            "variant": "outlined"
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "markdown": True,
-                        "content": "**Due date**"
-                    },
-                    {
-                        "type": "datepicker",
-                        "placeholder": "YYYY-MM-DD",
-                        "action_id": "a60389c6-2517-4388-8f56-da1aaf9c7b28"
-                    },
-                    {
-                        "type": "button",
-                        "label": "Create",
-                        "action_id": "asana_create_button",
-                        "style": "primary_filled"
-                    }
-                ]
-            }
+async def search_asana_options(user_id, asana_token, action_id, query):
+    # Typeahead for the assignee and project selects, answered from the in-memory directory index
+    options = []
+    if asana_token:
+        lookup = _asana_member_index if action_id == "asana_assignee_select" else _asana_project_index
+        try:
+            index = await asyncio.wait_for(lookup(user_id, asana_token), create_task_timeout)
+            options = index.search(query or "", asana_search_limit)
+        except AsanaUnauthorized:
+            metrics.token_refreshes.get("asana").inc()
+            asana_new_token = await refresh_asana_token(user_id)
+            if asana_new_token:
+                return await search_asana_options(user_id, asana_new_token, action_id, query)
+        except Exception as e:
+            logs.error("asana.search_failed", user_id=user_id, error=str(e))
+    return codec.json_response({
+        "callback_type": "query.suggestions",
+        "result": {
+            "options": options
         }
-    }
-    return create_modal
+    })
 
 
-async def task_message(channel_id: str, asana_task_name: str, selected_project_id: str, selected_assignee_id: str,
-                       due_date: str, user_id: str, swit_token: str, asana_token: str, task_description: str):
-    if not asana_token:
-        print("No Asana token found for the user.")
-        return None
-    asana_url = "https://app.asana.com/api/1.0/tasks"
+async def create_asana_task(user_id, asana_token, asana_task_name, selected_project_id, selected_assignee_id,
+                            due_date, task_description):
     asana_headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": f"Bearer {asana_token}"
+        "content-type": "application/json"
     }
     asana_body = {
         "data": {
@@ -759,18 +836,46 @@ async def task_message(channel_id: str, asana_task_name: str, selected_project_i
         }
     }
 
-    create_response = requests.post(asana_url, json=asana_body, headers=asana_headers)
+    started = perf_counter()
+    try:
+        create_response = await asana_client.request("POST", "tasks", asana_token, json=asana_body,
+                                                     headers=asana_headers)
+    finally:
+        metrics.asana_create_task_seconds.observe(perf_counter() - started)
+
+    if create_response.status_code == 401:
+        # Token refresh
+        metrics.token_refreshes.get("asana").inc()
+        asana_new_token = await refresh_asana_token(user_id)
+        if asana_new_token:
+            return await create_asana_task(user_id, asana_new_token, asana_task_name, selected_project_id,
+                                           selected_assignee_id, due_date, task_description)
+        return {"ok": False}
+    if create_response.status_code == 429 or create_response.status_code >= 500:
+        raise Exception(f"Asana task creation failed with status {create_response.status_code}")
+
+    if not create_response.is_success:
+        return {"ok": False}
 
-    bb = create_response.json()['data']
-    print(json.dumps(bb, indent=2))
+    try:
+        bb = create_response.json()['data']
+        logs.payload("asana.task_created", bb, user_id=user_id)
+        return {
+            "ok": True,
+            "gid": bb['gid'],
+            "project_name": bb['projects'][0]['name'] if bb['projects'] else None,
+            "assignee_name": bb['assignee']['name'] if bb['assignee'] else None
+        }
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        # The task exists at this point, so a retry would create it a second time
+        raise jobs.PermanentError(f"Unexpected Asana task response: {e!r}") from e
 
-    if create_response.ok:
 
-        task_id = bb['gid']
-        task_url = f"https://app.asana.com/0/{selected_project_id}/{task_id}"
-        selected_project_name = bb['projects'][0]['name']
-        selected_assignee_name = bb['assignee']['name'] if bb['assignee'] else None
-        result_content = {
+def task_result_content(user_id, created, asana_task_name, selected_project_id, selected_assignee_id, due_date,
+                        task_description):
+    if created['ok']:
+        task_url = f"https://app.asana.com/0/{selected_project_id}/{created['gid']}"
+        return {
             "type": "rich_text",
             "elements": [
                 {
@@ -786,9 +891,9 @@ async def task_message(channel_id: str, asana_task_name: str, selected_project_i
                     "elements": [
                         {"type": "rt_link", "url": task_url, "content": "View Task"},
                         {"type": "rt_text",
-                         "content": f"\nTask name: {asana_task_name} \nProject: {selected_project_name} \nTask description: {task_description}"},
+                         "content": f"\nTask name: {asana_task_name} \nProject: {created['project_name']} \nTask description: {task_description}"},
                         {"type": "rt_text",
-                         "content": f"\nAssignee: {selected_assignee_name}" if selected_assignee_id else "\nAssignee: No assignee"},
+                         "content": f"\nAssignee: {created['assignee_name']}" if selected_assignee_id else "\nAssignee: No assignee"},
                         {"type": "rt_text",
                          "content": f"\nDue date: {due_date}" if due_date else "\nDue date: No due date"}
 
@@ -796,126 +901,156 @@ async def task_message(channel_id: str, asana_task_name: str, selected_project_i
                 }
             ]
         }
-    else:
-        result_content = {
-            "type": "rich_text",
-            "elements": [
-                {
-                    "type": "rt_section",
-                    "elements": [
-                        {"type": "rt_text", "content": "Failed to create task: "},
-                        {"type": "rt_text", "content": " " + asana_task_name}
-                    ]
-                }
-            ]
-        }
-    message_url = swit_api_url + "v1/api/message.create"
-    message_headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Authorization": f"Bearer {swit_token}"
+    return {
+        "type": "rich_text",
+        "elements": [
+            {
+                "type": "rt_section",
+                "elements": [
+                    {"type": "rt_text", "content": "Failed to create task: "},
+                    {"type": "rt_text", "content": " " + asana_task_name}
+                ]
+            }
+        ]
     }
 
-    message_body = {
-        "channel_id": channel_id,
-        "content": json.dumps(result_content),
-        "body_type": "json_string"
-    }
 
-    message_response = requests.post(url=message_url, headers=message_headers, json=message_body)
-    cc = message_response.json()
-    print(json.dumps(cc, indent=2))
+async def send_task_message(user_id, channel_id, swit_token, result_content):
+    started = perf_counter()
+    try:
+        message_response = await message_dispatcher.submit(channel_id, swit_token, result_content)
+    finally:
+        metrics.swit_task_message_seconds.observe(perf_counter() - started)
 
     if message_response.status_code == 401:
-        # Token refresh
+        # Token refresh; only the message is resent, the Asana task already exists
+        metrics.token_refreshes.get("swit").inc()
         swit_new_token = await refresh_swit_token(user_id)
         if swit_new_token:
-            return await task_message(channel_id, asana_task_name, selected_project_id, selected_assignee_id, due_date,
-                                      user_id, swit_new_token)
-        else:
-            return initiate_oauth_flow(user_id, "asana_create", "ko", channel_id)
-    else:
-        return message_response.json()
+            return await send_task_message(user_id, channel_id, swit_new_token, result_content)
+        raise jobs.PermanentError(f"Swit authorization failed for user: {user_id}")
+    if message_response.status_code == 429 or message_response.status_code >= 500:
+        raise Exception(f"Swit message.create failed with status {message_response.status_code}")
 
+    cc = message_response.json()
+    logs.payload("swit.message_response", cc, channel_id=channel_id)
+    return cc
 
-async def new_task():
-    newtask_modal = {
-        "attachments": [
-            {
-                "body": {
-                    "elements": [
-                        {
-                            "action_id": "sarahtest",
-                            "items": [
-                                {
-                                    "label": "새로운 업무",
-                                    "text": {
-                                        "content": "**새 업무에 첨부**",
-                                        "markdown": True,
-                                        "type": "text"
-                                    }
-                                }
-                            ],
-                            "type": "info_card"
-                        }
-                    ]
-                },
-                "header": {
-                    "app_id": swit_app_id,
-                    "title": "새로운 태스크를 생성하고, Attachment를 추가합니다."
-                },
-                "state": "test state"
-            }
-        ],
-        "destination_hint": {
-            "workspace_id": "24012409543257ODXSGR",
-            "project_id": "24012901343960R33NR9",
-            "task_id": "24020106575334Q2G9UD"
-        },
-        "callback_type": "attachments.share.new_task"
-    }
 
-    return newtask_modal
+task_payload_keys = ("user_id", "channel_id", "asana_task_name", "selected_project_id", "selected_assignee_id",
+                     "due_date", "task_description")
 
 
-async def existing_task():
-    existingtask_modal = {
-        "attachments": [
-            {
-                "body": {
-                    "elements": [
-                        {
-                            "action_id": "sarahtest",
-                            "items": [
-                                {
-                                    "label": "기존 업무",
-                                    "text": {
-                                        "content": "기존 업무에 첨부",
-                                        "style": {},
-                                        "type": "text"
-                                    }
-                                }
-                            ],
-                            "type": "info_card"
-                        }
-                    ]
-                },
-                "header": {
-                    "app_id": swit_app_id,
-                    "title": "기존 태스크에 Attachment를 추가합니다."
-                },
-                "state": "test state"
-            }
-        ],
-        "destination_hint": {
-            "workspace_id": "24012409543257ODXSGR",
-            "project_id": "24012901343960R33NR9",
-            "task_id": "24020106575334Q2G9UD"
-        },
-        "callback_type": "attachments.share.existing_task"
-    }
+async def task_message(job):
+    # Runs from the job queue; tokens are loaded at run time so they are never written to the queue
+    payload = job.payload
+    missing = [key for key in task_payload_keys if key not in payload]
+    if missing:
+        raise jobs.PermanentError(f"task_message payload is missing {missing}")
+    user_id = payload['user_id']
+    credentials = await load_credentials(user_id)
+    if not credentials or not credentials.swit_token:
+        raise jobs.PermanentError(f"No Swit token found for user: {user_id}")
+
+    if payload.get('created') is None:
+        if not credentials.asana_token:
+            logs.warning("asana.token_missing", user_id=user_id)
+            return
+        payload['created'] = await create_asana_task(
+            user_id, credentials.asana_token, payload['asana_task_name'], payload['selected_project_id'],
+            payload['selected_assignee_id'], payload['due_date'], payload['task_description'])
+        # Checkpoint so a retry after a Swit failure does not create the Asana task twice
+        await job.checkpoint()
+
+    result_content = task_result_content(
+        user_id, payload['created'], payload['asana_task_name'], payload['selected_project_id'],
+        payload['selected_assignee_id'], payload['due_date'], payload['task_description'])
+    await send_task_message(user_id, payload['channel_id'], credentials.swit_token, result_content)
+
+
+task_jobs = jobs.JobQueue(
+    os.environ.get("JOB_QUEUE_PATH", "jobs.sqlite3"),
+    {"task_message": task_message},
+    workers=int(os.environ.get("JOB_WORKERS", "4")),
+    max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", "5")),
+    base_delay=float(os.environ.get("JOB_RETRY_BASE_DELAY", "1")),
+    max_delay=float(os.environ.get("JOB_RETRY_MAX_DELAY", "60"))
+)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/vault_stats")
+async def vault_stats(request: Request):
+    require_admin(request)
+    return vault.stats()
+
+
+@app.get("/breaker_stats")
+async def breaker_stats(request: Request):
+    require_admin(request)
+    return breaker.stats()
 
-    return existingtask_modal
+
+@app.get("/asana_client_stats")
+async def asana_client_stats(request: Request):
+    require_admin(request)
+    return asana_client.stats()
+
+
+@app.get("/job_stats")
+async def job_stats(request: Request):
+    require_admin(request)
+    return await task_jobs.stats()
+
+
+@app.get("/trace_stats")
+async def trace_stats(request: Request):
+    require_admin(request)
+    return tracing.stats()
+
+
+@app.post("/admin/profile")
+async def start_profile(request: Request, seconds: float = 10.0, user_action_id: str | None = None):
+    # Profiles the worker that receives this request; with several workers, repeat until each one is covered
+    require_admin(request)
+    try:
+        profile = profiler.start(seconds, user_action_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profile.stats()
+
+
+@app.delete("/admin/profile")
+async def stop_profile(request: Request):
+    require_admin(request)
+    profiler.stop()
+    return profiler.stats()
+
+
+@app.get("/admin/profile")
+async def profile_stats(request: Request):
+    require_admin(request)
+    return profiler.stats()
+
+
+@app.get("/admin/profile/collapsed")
+async def profile_collapsed(request: Request):
+    require_admin(request)
+    if profiler.profile is None:
+        raise HTTPException(status_code=404, detail="No profile has been taken")
+    return PlainTextResponse(profiler.profile.collapsed())
+
+
+async def new_task():
+    return views.new_task_view.response()
+
+
+async def existing_task():
+    return views.existing_task_view.response()
 
 
 @app.post("/app/asana22")
@@ -923,7 +1058,6 @@ async def app_asana(asdf: Request):
     timestamp = asdf.headers.get("x-swit-request-timestamp")
     signature = asdf.headers.get("x-swit-signature")
     request_body = await asdf.body()
-    request_body = request_body.decode()
 
     # if signature_verifier.is_valid(request_body, timestamp, signature):
     #     print("Valid signature")
@@ -931,26 +1065,61 @@ async def app_asana(asdf: Request):
     # if not signature_verifier.is_valid(request_body, timestamp, signature):
     #     raise HTTPException(status_code=400, detail="Invalid signature")
 
-    if is_valid(request_body, timestamp, signature):
-        print("Valid signature")
-    else:
+    # Root span for the delivery; DB queries and outbound HTTP calls made while handling it become children
+    with tracing.span("app_asana", parent=tracing.extract(asdf.headers)) as span:
+        return await _app_asana(asdf, span, request_body, timestamp, signature)
+
+
+async def _app_asana(asdf: Request, span, request_body, timestamp, signature):
+    started = perf_counter()
+    valid = is_valid(request_body, timestamp, signature)
+    metrics.signature_seconds.observe(perf_counter() - started)
+    if not valid:
+        logs.warning("webhook.invalid_signature", timestamp=timestamp)
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    aaaa = await asdf.json()
-    print(json.dumps(aaaa, indent=2))
-    user_action_id = aaaa['user_action']['id']
-    channel_id = aaaa['context']['channel_id']
-    user_language = aaaa['user_preferences']['language']
-    user_id = aaaa['user_info']['user_id']
-    swit_token = fetch_swit_token_from_db(user_id)
-    asana_token = fetch_asana_token_from_db(user_id)
-    user_action_type = aaaa['user_action']['type']
-    pre_filled_message = aaaa['user_action']['resource'][
-        'content'] if user_action_type == "user_commands.context_menus:message" else None
+    # Retries and duplicate deliveries stop here, before any token lookup or outbound call
+    delivery_id = asdf.headers.get(delivery_id_header) if delivery_id_header else None
+    replay_key = delivery_id or signature
+    if await webhook_replays.is_duplicate(replay_key):
+        logs.info("webhook.duplicate", timestamp=timestamp)
+        span.set_attribute("webhook.duplicate", True)
+        return views.close_view.response()
+
+    # The raw body is verified and parsed once; the handlers work on the typed event
+    event = codec.decode_webhook(request_body)
+    span.set_attribute("swit.user_action_id", event.user_action_id)
+    logs.payload("webhook.request", request_body, user_action_id=event.user_action_id)
+    try:
+        with profiler.track(event.user_action_id):
+            return await handle_event(event, signature)
+    except unavailable_errors as e:
+        await webhook_replays.forget(replay_key)
+        metrics.webhook_errors.get(event.user_action_id).inc()
+        logs.warning("webhook.dependency_unavailable", user_action_id=event.user_action_id, error=repr(e))
+        span.set_error(repr(e))
+        return views.unavailable_view.response()
+    except Exception:
+        await webhook_replays.forget(replay_key)
+        metrics.webhook_errors.get(event.user_action_id).inc()
+        raise
+
+
+async def handle_event(event: codec.WebhookEvent, signature):
+    user_action_id = event.user_action_id
+    channel_id = event.channel_id
+    user_language = event.user_language
+    user_id = event.user_id
+    started = perf_counter()
+    credentials = await load_credentials(user_id)
+    metrics.token_lookup_seconds.observe(perf_counter() - started)
+    swit_token = credentials.swit_token if credentials else None
+    asana_token = credentials.asana_token if credentials else None
+    pre_filled_message = event.resource_content if event.user_action_type == "user_commands.context_menus:message" else None
 
     if not swit_token:
         return_value = initiate_oauth_flow(user_id, user_action_id, user_language, channel_id)
-        print(return_value)
+        logs.info("webhook.oauth_required", user_id=user_id, user_action_id=user_action_id)
         return return_value
     else:
         if user_action_id == "asana_help":
@@ -969,30 +1138,68 @@ async def app_asana(asdf: Request):
             return callback
 
         elif user_action_id == "asana_oauth_button":
-            first_user_action, channel_id = aaaa['current_view']['state'].split(":")
+            first_user_action, channel_id = event.view_state.split(":")
             if first_user_action == 'asana_help':
                 return await help_message(user_id, user_language, channel_id, swit_token)
             elif first_user_action == 'asana_create':
                 return await create_task(user_id, channel_id, asana_token, pre_filled_message)
 
+        elif user_action_id in ("asana_assignee_select", "asana_project_select"):
+            return await search_asana_options(user_id, asana_token, user_action_id, event.user_action_value)
+
         elif user_action_id == "asana_create_button":
-            asana_task_name = aaaa['current_view']['body']['elements'][1]['value']
-            channel_id = aaaa['current_view']['state']
-            selected_project_list = aaaa['current_view']['body']['elements'][7]['value']
-            selected_project_id = selected_project_list[0] if selected_project_list else None
-            selected_assignee_list = aaaa['current_view']['body']['elements'][5]['value']
-            selected_assignee_id = selected_assignee_list[0] if selected_assignee_list else None
-            due_date = aaaa['current_view']['body']['elements'][9]['value']
-            task_description = aaaa['current_view']['body']['elements'][3]['value']
-
-            await task_message(channel_id, asana_task_name, selected_project_id, selected_assignee_id, due_date,
-                               user_id, swit_token, asana_token, task_description)
+            asana_task_name = event.value(views.task_name_action_id)
+            channel_id = event.view_state
+            selected_project_id = event.first_value(views.project_action_id)
+            selected_assignee_id = event.first_value(views.assignee_action_id)
+            due_date = event.value(views.due_date_action_id)
+            task_description = event.value(views.task_description_action_id)
+
+            # Task creation runs on the job queue so views.close returns without waiting on Asana and Swit
+            await task_jobs.enqueue("task_message", {
+                "user_id": user_id,
+                "channel_id": channel_id,
+                "asana_task_name": asana_task_name,
+                "selected_project_id": selected_project_id,
+                "selected_assignee_id": selected_assignee_id,
+                "due_date": due_date,
+                "task_description": task_description
+            }, idempotency_key=signature)
+
+        return views.close_view.response()
+
+
+def _installed(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
 
-        return {
-            "callback_type": "views.close"
-        }
+
+def serve():
+    host = os.environ.get("HOST", "localhost")
+    port = int(os.environ.get("PORT", "8282"))
+    if not production:
+        uvicorn.run("main:app", host=host, port=port, reload=True)
+        return
+
+    workers = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    if workers > 1 and not shared_cache.backend.shared:
+        logs.warning("server.unshared_cache", workers=workers,
+                     hint="set SHARED_CACHE_URL so workers share tokens, directory and dedup state")
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        reload=False,
+        loop="uvloop" if _installed("uvloop") else "asyncio",
+        http="httptools" if _installed("httptools") else "h11",
+        access_log=False,
+        proxy_headers=True
+    )
 
 
 if __name__ == "__main__":
-    create_table()
-    uvicorn.run("main:app", host="localhost", port=8282, reload=True)
+    serve()
@@ -0,0 +1,140 @@
+from bisect import bisect_left
+
+import logs
+
+# Every series is created here at import time with its label values fixed, so recording a value is a
+# dict lookup at most plus a few in-place increments. Rendered in the Prometheus text format on /metrics.
+
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    __slots__ = ("labels", "value")
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name):
+        yield f"{name}{{{self.labels}}}" if self.labels else name, self.value
+
+
+class Histogram:
+    __slots__ = ("labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, labels, bounds=latency_buckets):
+        self.labels = labels
+        self.bounds = bounds
+        # counts[i] holds observations in (bounds[i - 1], bounds[i]]; the last slot is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name):
+        prefix = self.labels + "," if self.labels else ""
+        cumulative = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}}', cumulative
+        suffix = f"{{{self.labels}}}" if self.labels else ""
+        yield f"{name}_sum{suffix}", self.sum
+        yield f"{name}_count{suffix}", self.count
+
+
+class Observed:
+    # A value kept elsewhere and read when /metrics is rendered
+    __slots__ = ("labels", "read")
+
+    def __init__(self, labels, read):
+        self.labels = labels
+        self.read = read
+
+    def samples(self, name):
+        yield f"{name}{{{self.labels}}}" if self.labels else name, self.read()
+
+
+class Family:
+    def __init__(self, name, help_text, kind, series, label=None, values=(), other="other"):
+        # label values are fixed up front; anything else is recorded under `other` to bound cardinality
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        if label is None:
+            self.children = {None: series("")}
+            self.other = self.children[None]
+        else:
+            self.children = {value: series(f'{label}="{value}"') for value in (*values, other)}
+            self.other = self.children[other]
+
+    def get(self, value=None):
+        return self.children.get(value, self.other)
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for child in self.children.values():
+            for sample, value in child.samples(self.name):
+                lines.append(f"{sample} {value}")
+
+
+families: list[Family] = []
+
+
+def counter(name, help_text, label=None, values=()) -> Family:
+    family = Family(name, help_text, "counter", Counter, label, values)
+    families.append(family)
+    return family
+
+
+def histogram(name, help_text, label=None, values=(), buckets=latency_buckets) -> Family:
+    family = Family(name, help_text, "histogram", lambda labels: Histogram(labels, buckets), label, values)
+    families.append(family)
+    return family
+
+
+def observed_counter(name, help_text, read) -> Family:
+    family = Family(name, help_text, "counter", lambda labels: Observed(labels, read))
+    families.append(family)
+    return family
+
+
+def render() -> str:
+    lines = []
+    for family in families:
+        family.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+user_action_ids = ("asana_help", "asana_create", "new_task", "existing_task", "asana_oauth_button",
+                   "asana_assignee_select", "asana_project_select", "asana_create_button")
+
+webhook_stage_seconds = histogram(
+    "webhook_stage_seconds", "Time spent in each stage of webhook handling", "stage",
+    ("signature", "token_lookup", "asana_workspaces", "asana_projects", "asana_members", "asana_create_task",
+     "swit_help_message", "swit_task_message"))
+signature_seconds = webhook_stage_seconds.get("signature")
+token_lookup_seconds = webhook_stage_seconds.get("token_lookup")
+asana_workspaces_seconds = webhook_stage_seconds.get("asana_workspaces")
+asana_projects_seconds = webhook_stage_seconds.get("asana_projects")
+asana_members_seconds = webhook_stage_seconds.get("asana_members")
+asana_create_task_seconds = webhook_stage_seconds.get("asana_create_task")
+swit_help_message_seconds = webhook_stage_seconds.get("swit_help_message")
+swit_task_message_seconds = webhook_stage_seconds.get("swit_task_message")
+
+db_pool_wait_seconds = histogram("db_pool_wait_seconds", "Time spent waiting for a database connection").get()
+
+token_refreshes = counter("token_refreshes_total", "Token refreshes triggered by a 401 response", "kind",
+                          ("swit", "asana"))
+oauth_redirects = counter("oauth_redirects_total", "Users sent through initiate_oauth_flow").get()
+webhook_errors = counter("webhook_errors_total", "Webhooks that failed, by user_action_id", "user_action_id",
+                         user_action_ids)
+log_records_dropped = observed_counter("log_records_dropped_total", "Log records dropped because the log queue was full",
+                                       lambda: logs.stats()["dropped"])
@@ -0,0 +1,188 @@
+import asyncio
+import os
+
+import jwt
+
+import db
+import logs
+import vault
+
+lock_name = "userdata_migrations"
+lock_timeout = int(os.environ.get("DB_MIGRATION_LOCK_TIMEOUT", "60"))
+
+token_columns = ("asana_id", "asana_token", "asana_refresh_token", "swit_token", "swit_refresh_token")
+
+
+def _dedupe_userdata(connection):
+    # Without a unique key every Swit OAuth added a row. Keep the newest row per swit_id,
+    # filling its empty columns from older rows (asana_oauth updated all of them), and drop the rest.
+    connection.start_transaction()
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("DELETE FROM userdata WHERE swit_id IS NULL")
+        cursor.execute("SELECT swit_id FROM userdata GROUP BY swit_id HAVING COUNT(*) > 1")
+        duplicated = [row[0] for row in cursor.fetchall()]
+        for swit_id in duplicated:
+            cursor.execute(f"SELECT id, {', '.join(token_columns)} FROM userdata WHERE swit_id = %s ORDER BY id DESC",
+                           (swit_id,))
+            rows = cursor.fetchall()
+            keep_id = rows[0][0]
+            merged = [next((row[i] for row in rows if row[i]), None) for i in range(1, len(token_columns) + 1)]
+            cursor.execute(f"UPDATE userdata SET {', '.join(f'{column} = %s' for column in token_columns)} "
+                           "WHERE id = %s", (*merged, keep_id))
+            cursor.execute("DELETE FROM userdata WHERE swit_id = %s AND id <> %s", (swit_id, keep_id))
+        connection.commit()
+    logs.info("db.migration_deduped", swit_ids=len(duplicated))
+
+
+def _encrypt_tokens(connection, batch_size=1000):
+    # Seals the plaintext tokens written before the vault existed; already encrypted values are left alone
+    columns = token_columns[1:]
+    after_id = 0
+    encrypted = 0
+    with connection.cursor(buffered=True) as cursor:
+        while True:
+            cursor.execute(f"SELECT id, swit_id, {', '.join(columns)} FROM userdata WHERE id > %s ORDER BY id LIMIT %s",
+                           (after_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            connection.start_transaction()
+            for row_id, swit_id, *values in rows:
+                if all(not value or vault.get().is_encrypted(value) for value in values):
+                    continue
+                sealed = [value if vault.get().is_encrypted(value) else vault.encrypt(value, swit_id, column)
+                          for value, column in zip(values, columns)]
+                cursor.execute(f"UPDATE userdata SET {', '.join(f'{column} = %s' for column in columns)} "
+                               "WHERE id = %s", (*sealed, row_id))
+                encrypted += 1
+            connection.commit()
+            after_id = rows[-1][0]
+    logs.info("db.migration_encrypted", rows=encrypted)
+
+
+def _token_expiry(token):
+    if not token:
+        return None
+    try:
+        return int(jwt.decode(token, options={"verify_signature": False})['exp'])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _backfill_token_expiry(connection, batch_size=1000):
+    # Reads exp out of the stored access tokens once, so the refresher can select due rows by index
+    after_id = 0
+    filled = 0
+    with connection.cursor(buffered=True) as cursor:
+        while True:
+            cursor.execute("SELECT id, swit_id, swit_token, asana_token FROM userdata WHERE id > %s ORDER BY id LIMIT %s",
+                           (after_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            connection.start_transaction()
+            for row_id, swit_id, swit_token, asana_token in rows:
+                try:
+                    swit_expires_at = _token_expiry(vault.decrypt(swit_token, swit_id, "swit_token"))
+                    asana_expires_at = _token_expiry(vault.decrypt(asana_token, swit_id, "asana_token"))
+                except vault.VaultError as e:
+                    logs.warning("db.migration_undecryptable_row", row_id=row_id, error=str(e))
+                    continue
+                if swit_expires_at is None and asana_expires_at is None:
+                    continue
+                cursor.execute("UPDATE userdata SET swit_expires_at = %s, asana_expires_at = %s WHERE id = %s",
+                               (swit_expires_at, asana_expires_at, row_id))
+                filled += 1
+            connection.commit()
+            after_id = rows[-1][0]
+    logs.info("db.migration_token_expiry", rows=filled)
+
+
+# (version, name, step); a step is a SQL statement or fn(connection). Applied versions are never edited, only appended.
+migrations = [
+    (1, "create userdata", """
+        CREATE TABLE IF NOT EXISTS userdata (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            swit_id VARCHAR(255),
+            asana_id VARCHAR(255),
+            asana_token TEXT,
+            asana_refresh_token VARCHAR(255),
+            swit_token TEXT,
+            swit_refresh_token VARCHAR(255)
+        )"""),
+    (2, "dedupe userdata by swit_id", _dedupe_userdata),
+    # Ids and tokens are ASCII; ascii_bin keeps the unique index small and compares exactly, and VARCHAR
+    # keeps tokens in the row instead of TEXT's off-page storage. The token widths leave room for the
+    # vault envelope (prefix, wrapped data key, nonce and tag, base64 encoded) around the plaintext.
+    (3, "unique swit_id and column types", """
+        ALTER TABLE userdata
+            MODIFY swit_id VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+            MODIFY asana_id VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            MODIFY asana_token VARCHAR(4096) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            MODIFY asana_refresh_token VARCHAR(2048) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            MODIFY swit_token VARCHAR(4096) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            MODIFY swit_refresh_token VARCHAR(2048) CHARACTER SET ascii COLLATE ascii_bin NULL,
+            ADD UNIQUE INDEX userdata_swit_id (swit_id)
+        """),
+    (4, "encrypt tokens", _encrypt_tokens),
+    # The refresher selects rows whose token expires soon through these indexes instead of decoding every
+    # token; users whose refresh keeps being rejected are skipped once the failure count reaches the limit
+    (5, "token expiry columns", """
+        ALTER TABLE userdata
+            ADD COLUMN swit_expires_at BIGINT NULL,
+            ADD COLUMN asana_expires_at BIGINT NULL,
+            ADD COLUMN swit_refresh_failures SMALLINT NOT NULL DEFAULT 0,
+            ADD COLUMN asana_refresh_failures SMALLINT NOT NULL DEFAULT 0,
+            ADD INDEX userdata_swit_expires_at (swit_expires_at),
+            ADD INDEX userdata_asana_expires_at (asana_expires_at)
+        """),
+    (6, "backfill token expiry", _backfill_token_expiry),
+]
+
+
+def _applied_versions(connection):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _migrate(connection):
+    # A named lock so several workers starting at once apply each migration exactly once
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, lock_timeout))
+        if cursor.fetchone()[0] != 1:
+            raise db.Error(f"Timed out waiting {lock_timeout}s for the migration lock")
+    try:
+        applied = _applied_versions(connection)
+        for version, name, step in migrations:
+            if version in applied:
+                continue
+            logs.info("db.migration_started", version=version, name=name)
+            if callable(step):
+                step(connection)
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute(step)
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            connection.commit()
+            logs.info("db.migration_applied", version=version, name=name)
+    finally:
+        with connection.cursor(buffered=True) as cursor:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+
+
+def _run():
+    # Not through db.run: migrations may take far longer than the per-query deadline
+    with db.init_pool().connection() as connection:
+        _migrate(connection)
+
+
+async def run():
+    await asyncio.to_thread(_run)
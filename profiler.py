@@ -0,0 +1,157 @@
+import os
+import sys
+import threading
+from collections import Counter
+from time import monotonic, strftime, time
+
+import logs
+
+profile_dir = os.environ.get("PROFILE_DIR", "profiles")
+sample_interval = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+max_seconds = float(os.environ.get("PROFILE_MAX_SECONDS", "300"))
+
+
+class SamplingProfiler:
+    # Samples the event loop thread's stack from a background thread every `interval` seconds and counts
+    # collapsed stacks (root;...;leaf), the input format of flamegraph.pl and speedscope. With a
+    # user_action_id only samples taken while a matching webhook handler is running are counted.
+    def __init__(self, seconds, interval, user_action_id=None, thread_id=None):
+        self.seconds = seconds
+        self.interval = interval
+        self.user_action_id = user_action_id
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks: Counter = Counter()
+        self.tracked = set()
+        self.path = None
+        self.started_at = None
+        self.finished_at = None
+        self.samples = 0
+        self.skipped = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+            self._labels[code] = label
+        return label
+
+    def _collapse(self, frame):
+        labels = []
+        matched = not self.user_action_id
+        while frame is not None:
+            if not matched and frame in self.tracked:
+                matched = True
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        if not matched:
+            return None
+        labels.reverse()
+        return ";".join(labels)
+
+    def _sample(self):
+        deadline = monotonic() + self.seconds
+        while not self._stop.wait(self.interval) and monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = self._collapse(frame) if frame is not None else None
+            if stack is None:
+                self.skipped += 1
+                continue
+            self.stacks[stack] += 1
+            self.samples += 1
+        self.finished_at = time()
+        self._write()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _write(self):
+        os.makedirs(profile_dir, exist_ok=True)
+        name = f"profile-{strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        if self.user_action_id:
+            name += f"-{self.user_action_id}"
+        path = os.path.join(profile_dir, name + ".folded")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.collapsed())
+        except OSError as e:
+            logs.error("profiler.write_failed", path=path, error=repr(e))
+            return
+        self.path = path
+        logs.info("profiler.finished", path=path, samples=self.samples, user_action_id=self.user_action_id)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "seconds": self.seconds,
+            "interval": self.interval,
+            "user_action_id": self.user_action_id,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "samples": self.samples,
+            "skipped": self.skipped,
+            "stacks": len(self.stacks),
+            "path": self.path,
+            "pid": os.getpid()
+        }
+
+
+# The running profile, or the last finished one; one per worker process
+profile: SamplingProfiler | None = None
+
+
+def start(seconds, user_action_id=None, interval=None) -> SamplingProfiler:
+    # Must be called from the event loop thread, which is the thread that gets sampled
+    global profile
+    if profile is not None and profile.running:
+        raise RuntimeError("A profile is already running")
+    profile = SamplingProfiler(min(seconds, max_seconds), interval or sample_interval, user_action_id)
+    profile.start()
+    logs.info("profiler.started", seconds=profile.seconds, user_action_id=user_action_id)
+    return profile
+
+
+def stop():
+    if profile is not None:
+        profile.stop()
+
+
+class track:
+    # Marks the calling function's frame as belonging to a request for user_action_id, so a filtered
+    # profile counts samples taken while that frame is on the stack. Nothing to do when no profile runs.
+    __slots__ = ("frame", "profile")
+
+    def __init__(self, user_action_id):
+        self.frame = None
+        self.profile = profile
+        if self.profile is not None and self.profile.user_action_id == user_action_id and self.profile.running:
+            self.frame = sys._getframe(1)
+
+    def __enter__(self):
+        if self.frame is not None:
+            self.profile.tracked.add(self.frame)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.frame is not None:
+            self.profile.tracked.discard(self.frame)
+            self.frame = None
+        return False
+
+
+def stats():
+    return profile.stats() if profile is not None else {"running": False}
@@ -0,0 +1,79 @@
+import asyncio
+from time import monotonic
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def is_idle(self, now):
+        return self.tokens + (now - self.updated_at) * self.rate >= self.capacity
+
+    async def acquire(self):
+        while True:
+            self._refill(monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BucketRegistry:
+    # One bucket per key (token, workspace, ...); idle buckets are dropped once max_keys is reached
+    def __init__(self, rate, capacity, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: dict = {}
+
+    def get(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                now = monotonic()
+                self._buckets = {kept_key: kept for kept_key, kept in self._buckets.items() if not kept.is_idle(now)}
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+        return bucket
+
+    async def acquire(self, key):
+        await self.get(key).acquire()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AIMDLimiter:
+    # Concurrency limit that grows by one per window of successes and halves when throttled
+    def __init__(self, initial=10, minimum=1, maximum=100, decrease_factor=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttled(self):
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
@@ -0,0 +1,65 @@
+from time import monotonic
+
+import shared_cache
+
+
+class ReplayGuard:
+    # Remembers delivery keys for `window` seconds in time buckets, so expiry drops a whole bucket
+    # instead of scanning entries. Keys live between window and window + one bucket.
+    def __init__(self, window, buckets=10, prefix="webhook:"):
+        self.window = window
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.prefix = prefix
+        self._buckets: dict[int, set] = {}
+
+        self.checked = 0
+        self.duplicates = 0
+
+    def _expire(self, current):
+        oldest = current - self.buckets
+        for index in [index for index in self._buckets if index < oldest]:
+            del self._buckets[index]
+
+    def _seen_locally(self, key) -> bool:
+        current = int(monotonic() // self.bucket_seconds)
+        self._expire(current)
+        if any(key in keys for keys in self._buckets.values()):
+            return True
+        self._buckets.setdefault(current, set()).add(key)
+        return False
+
+    async def is_duplicate(self, key) -> bool:
+        # Records the key and reports whether it was already recorded, here or (with a shared
+        # backend) by another worker
+        self.checked += 1
+        duplicate = self._seen_locally(key)
+        if not duplicate and shared_cache.backend.shared:
+            duplicate = not await shared_cache.add(self.prefix + key, self.window)
+            if duplicate:
+                # Another worker owns this delivery and may still fail and forget it, so only the shared
+                # key decides whether a later retry is a duplicate
+                self._discard(key)
+        if duplicate:
+            self.duplicates += 1
+        return duplicate
+
+    def _discard(self, key):
+        for keys in self._buckets.values():
+            keys.discard(key)
+
+    async def forget(self, key):
+        # For deliveries that failed, so the sender's retry is processed
+        self._discard(key)
+        if shared_cache.backend.shared:
+            await shared_cache.delete(self.prefix + key)
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._buckets.values())
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "checked": self.checked,
+            "duplicates": self.duplicates
+        }
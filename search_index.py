@@ -0,0 +1,39 @@
+from bisect import bisect_left
+
+
+class SearchIndex:
+    __slots__ = ("options", "_keys", "_positions")
+
+    def __init__(self, options, label_key="label"):
+        self.options = options
+        # Each label is indexed from the start of every word so "smi" finds "John Smith"
+        entries = []
+        for position, option in enumerate(options):
+            words = option[label_key].casefold().split()
+            for start in range(len(words)):
+                entries.append((" ".join(words[start:]), position))
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._positions = [position for _, position in entries]
+
+    def search(self, query, limit=20):
+        query = " ".join(query.casefold().split())
+        if not query:
+            return self.options[:limit]
+
+        results = []
+        seen = set()
+        for i in range(bisect_left(self._keys, query), len(self._keys)):
+            if not self._keys[i].startswith(query):
+                break
+            position = self._positions[i]
+            if position in seen:
+                continue
+            seen.add(position)
+            results.append(self.options[position])
+            if len(results) >= limit:
+                break
+        return results
+
+    def __len__(self):
+        return len(self.options)
@@ -0,0 +1,225 @@
+import os
+from collections import OrderedDict
+from random import getrandbits
+from time import monotonic
+from urllib.parse import urlsplit
+
+import breaker
+import codec
+import logs
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+# memory:// keeps state in this process only; redis://host:port/db (or any Redis-compatible server)
+# shares it between workers
+backend_url = os.environ.get("SHARED_CACHE_URL", "memory://")
+key_prefix = os.environ.get("SHARED_CACHE_PREFIX", "asana_app:")
+memory_max_size = int(os.environ.get("SHARED_CACHE_MEMORY_MAX_SIZE", "100000"))
+# Versions only have to outlive the values stored under them
+version_ttl = float(os.environ.get("SHARED_CACHE_VERSION_TTL", "86400"))
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        # key -> (expires_at, value), ordered from least to most recently written
+        self._entries: OrderedDict = OrderedDict()
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def _store(self, key, value, ttl):
+        self._entries[key] = (monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key) -> bytes | None:
+        return self._live(key)
+
+    async def set(self, key, value: bytes, ttl: float):
+        self._store(key, value, ttl)
+
+    async def add(self, key, value: bytes, ttl: float) -> bool:
+        # Set only if absent; the building block for locks and dedup
+        if self._live(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def delete(self, key):
+        self._entries.pop(key, None)
+
+    async def close(self):
+        self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url, prefix):
+        self._client = redis_asyncio.from_url(url)
+        self.prefix = prefix
+        self.circuit = breaker.register("shared_cache", float(os.environ.get("SHARED_CACHE_TIMEOUT", "0.5")),
+                                        is_failure=None)
+
+    async def get(self, key) -> bytes | None:
+        return await self.circuit.call(self._client.get, self.prefix + key)
+
+    async def set(self, key, value: bytes, ttl: float):
+        await self.circuit.call(self._client.set, self.prefix + key, value, px=max(int(ttl * 1000), 1))
+
+    async def add(self, key, value: bytes, ttl: float) -> bool:
+        return bool(await self.circuit.call(self._client.set, self.prefix + key, value,
+                                            px=max(int(ttl * 1000), 1), nx=True))
+
+    async def delete(self, key):
+        await self.circuit.call(self._client.delete, self.prefix + key)
+
+    async def close(self):
+        await self._client.aclose()
+
+    def size(self):
+        return None
+
+
+def create_backend(url):
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        return MemoryBackend(memory_max_size)
+    if scheme in ("redis", "rediss", "unix"):
+        if redis_asyncio is None:
+            raise RuntimeError("SHARED_CACHE_URL points at Redis but the redis package is not installed")
+        return RedisBackend(url, key_prefix)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL scheme: {scheme}")
+
+
+backend = create_backend(backend_url)
+
+counters = {
+    "hits": 0,
+    "misses": 0,
+    "errors": 0
+}
+
+
+async def load_json(key, ttl, load, fresh=False):
+    # Read-through for state every worker should agree on. With the in-process backend each worker
+    # already keeps its own copy, so load() is called directly instead of storing the value twice.
+    # fresh skips the cached value, when the caller knows it is out of date, and replaces it. ttl may be a
+    # function of the loaded value; a value whose ttl is not positive is returned but not stored.
+    if not backend.shared:
+        return await load()
+    cached = None
+    if not fresh:
+        try:
+            cached = await backend.get(key)
+        except Exception as e:
+            counters["errors"] += 1
+            logs.warning("shared_cache.get_failed", key=key, error=repr(e))
+    if cached is not None:
+        counters["hits"] += 1
+        return codec.loads(cached)
+    counters["misses"] += 1
+    value = await load()
+    if value is not None and callable(ttl):
+        ttl = ttl(value)
+    if value is not None and ttl > 0:
+        try:
+            await backend.set(key, codec.dumps(value), ttl)
+        except Exception as e:
+            counters["errors"] += 1
+            logs.warning("shared_cache.set_failed", key=key, error=repr(e))
+    return value
+
+
+async def get(key) -> bytes | None:
+    try:
+        return await backend.get(key)
+    except Exception as e:
+        counters["errors"] += 1
+        logs.warning("shared_cache.get_failed", key=key, error=repr(e))
+        return None
+
+
+async def put(key, ttl, value: bytes):
+    try:
+        await backend.set(key, value, ttl)
+    except Exception as e:
+        counters["errors"] += 1
+        logs.warning("shared_cache.set_failed", key=key, error=repr(e))
+
+
+async def version(name) -> str | None:
+    # Current version of a group of keys that embed it. Writers bump() it after changing the source of
+    # truth, so a value a slower reader loaded before the change is stored under a key nobody reads any
+    # more. None when the backend is unreachable, in which case nothing should be stored.
+    key = f"version:{name}"
+    try:
+        current = await backend.get(key)
+        if current is None:
+            await backend.add(key, f"{getrandbits(64):x}".encode(), version_ttl)
+            current = await backend.get(key)
+    except Exception as e:
+        counters["errors"] += 1
+        logs.warning("shared_cache.get_failed", key=key, error=repr(e))
+        return None
+    return current.decode() if current is not None else None
+
+
+async def bump(name):
+    await put(f"version:{name}", version_ttl, f"{getrandbits(64):x}".encode())
+
+
+async def add(key, ttl, value=b"1") -> bool:
+    # True when this worker took the key; if the backend is unreachable every worker proceeds on its own
+    try:
+        return await backend.add(key, value, ttl)
+    except Exception as e:
+        counters["errors"] += 1
+        logs.warning("shared_cache.add_failed", key=key, error=repr(e))
+        return True
+
+
+async def exists(key) -> bool:
+    try:
+        return await backend.get(key) is not None
+    except Exception as e:
+        counters["errors"] += 1
+        logs.warning("shared_cache.get_failed", key=key, error=repr(e))
+        return False
+
+
+async def delete(key):
+    try:
+        await backend.delete(key)
+    except Exception as e:
+        counters["errors"] += 1
+        logs.warning("shared_cache.delete_failed", key=key, error=repr(e))
+
+
+async def close():
+    await backend.close()
+
+
+def stats():
+    return {
+        "backend": type(backend).__name__,
+        "shared": backend.shared,
+        "size": backend.size(),
+        **counters
+    }
@@ -0,0 +1,32 @@
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict = {}
+        self.executed = 0
+        self.shared = 0
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def do(self, key, fn, *args):
+        # Concurrent callers with the same key await one run of fn and share its result
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.executed += 1
+        else:
+            self.shared += 1
+        # shield so a cancelled caller does not abort the call other callers are waiting on
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "shared": self.shared
+        }
@@ -0,0 +1,65 @@
+import re
+
+from fastapi.responses import Response
+
+from codec import dumps
+
+_slot_pattern = re.compile(r'"\\u0000slot:(\w+)\\u0000"')
+
+
+class Slot:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _mark(node):
+    if isinstance(node, Slot):
+        return f"\x00slot:{node.name}\x00"
+    if isinstance(node, dict):
+        return {key: _mark(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_mark(value) for value in node]
+    return node
+
+
+class Template:
+    # The structure is serialized once; rendering only encodes the Slot values and joins the pieces
+    __slots__ = ("name", "structure", "_static", "_slots")
+
+    def __init__(self, name, structure):
+        self.name = name
+        self.structure = structure
+        pieces = _slot_pattern.split(dumps(_mark(structure)).decode())
+        self._static = tuple(piece.encode() for piece in pieces[0::2])
+        self._slots = tuple(pieces[1::2])
+
+    @property
+    def slots(self):
+        return self._slots
+
+    def render_bytes(self, **values) -> bytes:
+        static = self._static
+        if not self._slots:
+            return static[0]
+        parts = [static[0]]
+        for i, slot in enumerate(self._slots, 1):
+            parts.append(dumps(values[slot]))
+            parts.append(static[i])
+        return b"".join(parts)
+
+    def render(self, **values) -> str:
+        return self.render_bytes(**values).decode()
+
+    def response(self, **values) -> Response:
+        return Response(content=self.render_bytes(**values), media_type="application/json")
+
+
+registry: dict[str, Template] = {}
+
+
+def register(name, structure) -> Template:
+    template = Template(name, structure)
+    registry[name] = template
+    return template
@@ -0,0 +1,24 @@
+import os
+import sys
+
+# The app is a set of top-level modules run from the repository root, as the benchmarks do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(request, monkeypatch):
+    # A monotonic() the test moves by hand, patched into the modules named by the test module's `clocked`
+    clock = Clock()
+    for module in request.module.clocked:
+        monkeypatch.setattr(module, "monotonic", clock)
+    return clock
@@ -0,0 +1,98 @@
+import asyncio
+
+import asana_directory
+from asana_directory import DirectoryCache
+
+
+class Source:
+    # A workspace listing with an events feed: every edit bumps the version, sync tokens name a version
+    def __init__(self):
+        self.version = 0
+        self.loads = []
+
+    async def changed(self, sync_token):
+        return sync_token == str(self.version), str(self.version)
+
+    async def load(self, fresh):
+        self.loads.append(fresh)
+        return f"listing v{self.version}", str(self.version)
+
+
+def test_unchanged_sync_keeps_the_entry():
+    async def scenario():
+        cache = DirectoryCache(ttl=0, stale_ttl=0)
+        source = Source()
+        assert await cache.get("key", source.load, source.changed) == "listing v0"
+        assert await cache.get("key", source.load, source.changed) == "listing v0"
+        return cache, source
+
+    cache, source = asyncio.run(scenario())
+    assert source.loads == [False]
+    assert cache.unchanged_syncs == 1
+
+
+def test_detected_change_bypasses_shared_copies():
+    async def scenario():
+        cache = DirectoryCache(ttl=0, stale_ttl=0)
+        source = Source()
+        await cache.get("key", source.load, source.changed)
+        source.version += 1
+        assert await cache.get("key", source.load, source.changed) == "listing v1"
+        return source
+
+    assert asyncio.run(scenario()).loads == [False, True]
+
+
+def test_shared_listing_keeps_the_sync_token_it_was_loaded_with(monkeypatch):
+    store = {}
+
+    async def load_json(key, ttl, load, fresh=False):
+        if fresh or key not in store:
+            store[key] = await load()
+        return store[key]
+
+    monkeypatch.setattr(asana_directory.shared_cache, "load_json", load_json)
+    source = Source()
+
+    async def listing():
+        return [f"project v{source.version}"]
+
+    async def scenario():
+        load = asana_directory._shared(("projects", "1"), listing, source.changed)
+        first = await load(False)
+        # Another worker reads the shared listing after a change: it gets the token the listing was taken
+        # with, so its next sync sees the change instead of renewing the old listing
+        source.version += 1
+        second = await load(False)
+        third = await load(True)
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first == second == (["project v0"], "0")
+    assert third == (["project v1"], "1")
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.is_success = 200 <= status_code < 300
+
+
+def test_only_plan_and_permission_errors_disable_the_events_check(monkeypatch):
+    statuses = []
+
+    async def get(path, asana_token, params=None, workspace_id=None):
+        statuses.append(status)
+        return Response(status)
+
+    monkeypatch.setattr(asana_directory.asana_client, "get", get)
+    monkeypatch.setattr(asana_directory, "_events_unsupported", set())
+    changed = asana_directory._workspace_changes("1", "token", ("project",))
+    for status in (429, 503):
+        assert asyncio.run(changed("sync")) == (False, None)
+    assert asana_directory._events_unsupported == set()
+    status = 402
+    asyncio.run(changed("sync"))
+    asyncio.run(changed("sync"))
+    assert asana_directory._events_unsupported == {"1"}
+    assert statuses == [429, 503, 402]
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+import breaker
+from breaker import CircuitBreaker, CircuitOpen
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+clocked = (breaker,)
+
+
+async def ok():
+    return "ok"
+
+
+async def fail():
+    raise ConnectionError("down")
+
+
+def call(circuit, fn, *args):
+    return asyncio.run(circuit.call(fn, *args))
+
+
+def trip(circuit):
+    for _ in range(circuit.failure_threshold):
+        with pytest.raises(ConnectionError):
+            call(circuit, fail)
+
+
+def test_opens_after_consecutive_failures(clock):
+    circuit = CircuitBreaker("dep", failure_threshold=3, reset_timeout=30)
+    trip(circuit)
+    assert circuit.stats()["state"] == "open"
+    with pytest.raises(CircuitOpen):
+        call(circuit, ok)
+    assert circuit.rejected == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    circuit = CircuitBreaker("dep", failure_threshold=3)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            call(circuit, fail)
+    call(circuit, ok)
+    with pytest.raises(ConnectionError):
+        call(circuit, fail)
+    assert circuit.state == "closed"
+
+
+def test_half_open_probe_closes_on_success(clock):
+    circuit = CircuitBreaker("dep", failure_threshold=1, reset_timeout=30)
+    trip(circuit)
+    clock.now += 31
+    assert call(circuit, ok) == "ok"
+    assert circuit.stats()["state"] == "closed"
+
+
+def test_half_open_probe_reopens_on_failure(clock):
+    circuit = CircuitBreaker("dep", failure_threshold=2, reset_timeout=30)
+    trip(circuit)
+    clock.now += 31
+    # A single failed probe is enough, whatever the threshold
+    with pytest.raises(ConnectionError):
+        call(circuit, fail)
+    assert circuit.stats()["state"] == "open"
+    assert circuit.opened == 2
+
+
+def test_only_one_probe_at_a_time(clock):
+    async def scenario(circuit):
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "probe"
+
+        probe = asyncio.create_task(circuit.call(slow))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpen):
+            await circuit.call(ok)
+        release.set()
+        return await probe
+
+    circuit = CircuitBreaker("dep", failure_threshold=1, reset_timeout=30)
+    trip(circuit)
+    clock.now += 31
+    assert asyncio.run(scenario(circuit)) == "probe"
+    assert circuit.state == "closed"
+
+
+def test_cancelled_probe_lets_the_next_call_probe(clock):
+    async def scenario(circuit):
+        probe = asyncio.create_task(circuit.call(asyncio.sleep, 60))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await circuit.call(ok)
+
+    circuit = CircuitBreaker("dep", failure_threshold=1, reset_timeout=30)
+    trip(circuit)
+    clock.now += 31
+    assert asyncio.run(scenario(circuit)) == "ok"
+
+
+def test_timeouts_count_as_failures():
+    circuit = CircuitBreaker("dep", timeout=0.01, failure_threshold=1)
+    with pytest.raises(asyncio.TimeoutError):
+        call(circuit, asyncio.sleep, 1)
+    assert circuit.timeouts == 1
+    assert circuit.state == "open"
+
+
+def test_bad_results_count_as_failures():
+    async def server_error():
+        return Response(503)
+
+    async def client_error():
+        return Response(404)
+
+    circuit = CircuitBreaker("dep", failure_threshold=1, is_failure=breaker.server_error)
+    # A 4xx is a healthy answer; the 5xx is returned to the caller but opens the breaker
+    assert call(circuit, client_error).status_code == 404
+    assert circuit.state == "closed"
+    assert call(circuit, server_error).status_code == 503
+    assert circuit.state == "open"
+
+
+class Busy(Exception):
+    pass
+
+
+async def busy():
+    raise Busy()
+
+
+def test_ignored_exceptions_do_not_trip():
+    circuit = CircuitBreaker("dep", failure_threshold=1, ignore=(Busy,))
+    for _ in range(3):
+        with pytest.raises(Busy):
+            call(circuit, busy)
+    assert circuit.state == "closed"
+    assert circuit.failed == 0
+
+
+def test_ignored_exceptions_do_not_reset_the_failure_count():
+    circuit = CircuitBreaker("dep", failure_threshold=3, ignore=(Busy,))
+    for fn, error in ((fail, ConnectionError), (fail, ConnectionError), (busy, Busy), (busy, Busy)):
+        with pytest.raises(error):
+            call(circuit, fn)
+    assert circuit.failures == 2
+    with pytest.raises(ConnectionError):
+        call(circuit, fail)
+    assert circuit.state == "open"
+
+
+def test_ignored_exception_in_a_half_open_probe_leaves_the_breaker_half_open(clock):
+    circuit = CircuitBreaker("dep", failure_threshold=1, reset_timeout=30, ignore=(Busy,))
+    trip(circuit)
+    clock.now += 31
+    with pytest.raises(Busy):
+        call(circuit, busy)
+    assert circuit.stats()["state"] == "half_open"
+    # The probe slot is free again and the next real answer decides
+    with pytest.raises(ConnectionError):
+        call(circuit, fail)
+    assert circuit.stats()["state"] == "open"
+
+
+def test_db_pool_timeout_does_not_trip_the_mysql_breaker():
+    db = pytest.importorskip("db")
+    assert issubclass(db.PoolTimeout, db.circuit.ignore)
+    assert db.pool_acquire_timeout < db.query_timeout
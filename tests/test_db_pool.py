@@ -0,0 +1,60 @@
+import pytest
+
+db = pytest.importorskip("db")
+
+clocked = (db,)
+
+
+class Connection:
+    def __init__(self):
+        self.pings = 0
+        self.closed = False
+        self.dead = False
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.dead:
+            raise db.Error("gone away")
+
+    def is_connected(self):
+        raise AssertionError("is_connected() pings the server")
+
+    def rollback(self):
+        if self.dead:
+            raise db.Error("gone away")
+
+    def close(self):
+        self.closed = True
+
+
+def test_release_returns_the_connection_without_a_round_trip():
+    pool = db.ConnectionPool(Connection, max_size=1)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert second is first
+    assert first.pings == 0
+    assert pool.stats()["opened"] == 1
+
+
+def test_connection_that_died_mid_query_is_discarded():
+    pool = db.ConnectionPool(Connection, max_size=1)
+    with pytest.raises(db.Error):
+        with pool.connection() as first:
+            first.dead = True
+            raise db.Error("lost connection during query")
+    assert first.closed
+    with pool.connection() as second:
+        assert second is not first
+
+
+def test_idle_connection_is_pinged_on_acquire(clock):
+    pool = db.ConnectionPool(Connection, max_size=1, health_check_interval=30, recycle=300)
+    with pool.connection() as first:
+        first.dead = True
+    clock.now += 31
+    with pool.connection() as second:
+        assert second is not first
+    assert first.pings == 1
+    assert pool.stats()["health_check_failures"] == 1
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from dispatcher import MessageDispatcher
+
+
+def rich_text(text):
+    return {"type": "rich_text", "elements": [{"type": "rt_section", "elements": [{"type": "rt_text",
+                                                                                  "content": text}]}]}
+
+
+class Recorder:
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = fail
+
+    async def __call__(self, channel_id, swit_token, content):
+        self.sent.append((channel_id, swit_token, content))
+        if self.fail is not None:
+            raise self.fail
+        return f"response-{len(self.sent)}"
+
+
+def texts(content):
+    return [section['elements'][0]['content'] for section in content['elements']]
+
+
+def test_rich_text_for_the_same_channel_and_token_is_merged():
+    async def scenario():
+        send = Recorder()
+        dispatcher = MessageDispatcher(send, rate=100, burst=100, linger=0.01)
+        responses = await asyncio.gather(*(dispatcher.submit("channel", "token", rich_text(str(n)))
+                                           for n in range(3)))
+        await dispatcher.close()
+        return send, responses, dispatcher.stats()
+
+    send, responses, stats = asyncio.run(scenario())
+    assert len(send.sent) == 1
+    assert texts(send.sent[0][2]) == ["0", "1", "2"]
+    assert responses == ["response-1"] * 3
+    assert stats["coalesced"] == 2
+
+
+def test_batches_are_capped_at_max_batch():
+    async def scenario():
+        send = Recorder()
+        dispatcher = MessageDispatcher(send, rate=100, burst=100, linger=0.01, max_batch=2)
+        await asyncio.gather(*(dispatcher.submit("channel", "token", rich_text(str(n))) for n in range(5)))
+        await dispatcher.close()
+        return send
+
+    send = asyncio.run(scenario())
+    assert [texts(content) for _, _, content in send.sent] == [["0", "1"], ["2", "3"], ["4"]]
+
+
+def test_different_keys_and_pre_rendered_content_are_not_merged():
+    async def scenario():
+        send = Recorder()
+        dispatcher = MessageDispatcher(send, rate=100, burst=100, linger=0.01)
+        await asyncio.gather(
+            dispatcher.submit("channel", "token-a", rich_text("a")),
+            dispatcher.submit("channel", "token-b", rich_text("b")),
+            dispatcher.submit("channel", "token-a", '{"type": "rich_text", "elements": []}'),
+        )
+        await dispatcher.close()
+        return send
+
+    send = asyncio.run(scenario())
+    assert len(send.sent) == 3
+
+
+def test_pre_rendered_content_skips_the_linger():
+    async def scenario():
+        send = Recorder()
+        dispatcher = MessageDispatcher(send, rate=100, burst=100, linger=10)
+        response = await asyncio.wait_for(dispatcher.submit("channel", "token", '{"text": "help"}'), 1)
+        await dispatcher.close()
+        return response
+
+    assert asyncio.run(scenario()) == "response-1"
+
+
+def test_send_failure_reaches_every_message_in_the_batch():
+    async def scenario():
+        dispatcher = MessageDispatcher(Recorder(fail=RuntimeError("swit down")), rate=100, burst=100, linger=0.01)
+        results = await asyncio.gather(*(dispatcher.submit("channel", "token", rich_text(str(n))) for n in range(2)),
+                                       return_exceptions=True)
+        await dispatcher.close()
+        return results, dispatcher.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert stats["errors"] == 1
+
+
+def test_a_failed_batch_does_not_stop_later_ones():
+    async def scenario():
+        calls = 0
+
+        async def send(channel_id, swit_token, content):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("first send fails")
+            return "ok"
+
+        dispatcher = MessageDispatcher(send, rate=100, burst=100, linger=0.01, max_batch=1)
+        results = await asyncio.gather(*(dispatcher.submit("channel", "token", rich_text(str(n))) for n in range(2)),
+                                       return_exceptions=True)
+        await dispatcher.close()
+        return results
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert second == "ok"
+
+
+def test_close_cancels_messages_still_waiting():
+    async def scenario():
+        dispatcher = MessageDispatcher(Recorder(), rate=100, burst=100, linger=10)
+        pending = asyncio.create_task(dispatcher.submit("channel", "token", rich_text("late")))
+        await asyncio.sleep(0)
+        await dispatcher.close()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        return dispatcher.queue_depth()
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,172 @@
+import asyncio
+
+import jobs
+
+
+def make_queue(tmp_path, handlers, **kwargs):
+    kwargs.setdefault("workers", 1)
+    kwargs.setdefault("base_delay", 0.01)
+    kwargs.setdefault("max_delay", 0.01)
+    kwargs.setdefault("poll_interval", 0.01)
+    return jobs.JobQueue(str(tmp_path / "jobs.sqlite3"), handlers, **kwargs)
+
+
+def rows(queue):
+    return queue._locked(lambda connection: connection.execute(
+        "SELECT kind, status, attempts, payload, last_error FROM jobs ORDER BY id").fetchall())
+
+
+async def wait_for(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_enqueue_is_idempotent_per_key(tmp_path):
+    async def scenario():
+        queue = make_queue(tmp_path, {})
+        first = await queue.enqueue("kind", {"n": 1}, idempotency_key="delivery-1")
+        second = await queue.enqueue("kind", {"n": 2}, idempotency_key="delivery-1")
+        return queue, first, second
+
+    queue, first, second = asyncio.run(scenario())
+    assert (first, second) == (True, False)
+    assert queue.duplicates == 1
+    assert len(rows(queue)) == 1
+
+
+def test_claim_marks_running_and_counts_the_attempt(tmp_path):
+    queue = make_queue(tmp_path, {})
+    asyncio.run(queue.enqueue("kind", {}))
+    job_id, kind, _, attempts = queue._locked(queue._claim)
+    assert (kind, attempts) == ("kind", 1)
+    assert rows(queue)[0][1] == "running"
+    # A running job is not claimed again until its lease runs out
+    assert queue._locked(queue._claim) is None
+    queue.lease = 0.0
+    assert queue._locked(queue._claim)[0] == job_id
+
+
+def test_failed_job_is_retried_until_it_succeeds(tmp_path):
+    async def scenario():
+        attempts = []
+
+        async def flaky(job):
+            attempts.append(job.attempts)
+            if len(attempts) < 3:
+                raise RuntimeError("try again")
+
+        queue = make_queue(tmp_path, {"flaky": flaky})
+        queue.start()
+        await queue.enqueue("flaky", {})
+        await wait_for(lambda: queue.succeeded == 1)
+        await queue.stop()
+        return queue, attempts
+
+    queue, attempts = asyncio.run(scenario())
+    assert attempts == [1, 2, 3]
+    assert queue.retried == 2
+    assert rows(queue)[0][1] == "done"
+
+
+def test_permanent_error_and_max_attempts_fail_the_job(tmp_path):
+    async def scenario():
+        async def permanent(job):
+            raise jobs.PermanentError("no token")
+
+        async def broken(job):
+            raise RuntimeError("still broken")
+
+        queue = make_queue(tmp_path, {"permanent": permanent, "broken": broken}, max_attempts=2)
+        queue.start()
+        await queue.enqueue("permanent", {})
+        await queue.enqueue("broken", {})
+        await queue.enqueue("unknown", {})
+        await wait_for(lambda: queue.failed == 3)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+    by_kind = {kind: (status, attempts) for kind, status, attempts, _, _ in rows(queue)}
+    assert by_kind == {"permanent": ("failed", 1), "broken": ("failed", 2), "unknown": ("failed", 1)}
+
+
+def test_key_error_in_a_handler_is_retried(tmp_path):
+    async def scenario():
+        calls = 0
+
+        async def lookup(job):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise KeyError("transient")
+
+        queue = make_queue(tmp_path, {"lookup": lookup})
+        queue.start()
+        await queue.enqueue("lookup", {})
+        await wait_for(lambda: queue.succeeded == 1)
+        await queue.stop()
+        return calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_checkpoint_survives_a_retry(tmp_path):
+    async def scenario():
+        seen = []
+
+        async def two_steps(job):
+            seen.append(dict(job.payload))
+            if "created" not in job.payload:
+                job.payload["created"] = "task-1"
+                await job.checkpoint()
+                raise RuntimeError("second step failed")
+
+        queue = make_queue(tmp_path, {"two_steps": two_steps})
+        queue.start()
+        await queue.enqueue("two_steps", {"name": "task"})
+        await wait_for(lambda: queue.succeeded == 1)
+        await queue.stop()
+        return seen
+
+    assert asyncio.run(scenario()) == [{"name": "task"}, {"name": "task", "created": "task-1"}]
+
+
+def test_stop_hands_running_jobs_back(tmp_path):
+    async def scenario():
+        started = asyncio.Event()
+
+        async def slow(job):
+            started.set()
+            await asyncio.sleep(60)
+
+        queue = make_queue(tmp_path, {"slow": slow}, shutdown_grace=0.05)
+        queue.start()
+        await queue.enqueue("slow", {})
+        await started.wait()
+        await queue.stop()
+        return make_queue(tmp_path, {})
+
+    queue = asyncio.run(scenario())
+    kind, status, attempts, _, _ = rows(queue)[0]
+    assert (status, attempts) == ("pending", 0)
+    assert queue._locked(queue._claim) is not None
+
+
+def test_stop_lets_short_jobs_finish(tmp_path):
+    async def scenario():
+        started = asyncio.Event()
+
+        async def short(job):
+            started.set()
+            await asyncio.sleep(0.05)
+
+        queue = make_queue(tmp_path, {"short": short}, shutdown_grace=5)
+        queue.start()
+        await queue.enqueue("short", {})
+        await started.wait()
+        await queue.stop()
+        return make_queue(tmp_path, {})
+
+    assert rows(asyncio.run(scenario()))[0][1] == "done"
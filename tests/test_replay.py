@@ -0,0 +1,63 @@
+import asyncio
+
+import replay
+import shared_cache
+from replay import ReplayGuard
+
+
+clocked = (replay,)
+
+
+def is_duplicate(guard, key):
+    return asyncio.run(guard.is_duplicate(key))
+
+
+def test_second_delivery_is_a_duplicate(clock):
+    guard = ReplayGuard(window=60)
+    assert not is_duplicate(guard, "signature-1")
+    assert is_duplicate(guard, "signature-1")
+    assert not is_duplicate(guard, "signature-2")
+    assert guard.stats() == {"size": 2, "checked": 3, "duplicates": 1}
+
+
+def test_keys_expire_after_the_window(clock):
+    guard = ReplayGuard(window=60, buckets=10)
+    assert not is_duplicate(guard, "signature")
+    clock.now += 60
+    # Still remembered: keys live between window and window + one bucket
+    assert is_duplicate(guard, "signature")
+    clock.now += 6.1
+    assert not is_duplicate(guard, "other")
+    assert len(guard) == 1
+    assert not is_duplicate(guard, "signature")
+
+
+def test_expiry_drops_whole_buckets(clock):
+    guard = ReplayGuard(window=10, buckets=10)
+    for n in range(10):
+        assert not is_duplicate(guard, f"key-{n}")
+        clock.now += 1
+    assert len(guard._buckets) == 10
+    clock.now += 5
+    is_duplicate(guard, "new")
+    assert len(guard._buckets) <= 10
+    assert len(guard) < 11
+
+
+def test_forgotten_key_is_processed_again(clock):
+    guard = ReplayGuard(window=60)
+    assert not is_duplicate(guard, "signature")
+    asyncio.run(guard.forget("signature"))
+    assert not is_duplicate(guard, "signature")
+
+
+def test_shared_backend_catches_deliveries_seen_by_another_worker(clock, monkeypatch):
+    backend = shared_cache.MemoryBackend()
+    monkeypatch.setattr(backend, "shared", True)
+    monkeypatch.setattr(shared_cache, "backend", backend)
+    worker_a = ReplayGuard(window=60)
+    worker_b = ReplayGuard(window=60)
+    assert not is_duplicate(worker_a, "signature")
+    assert is_duplicate(worker_b, "signature")
+    asyncio.run(worker_a.forget("signature"))
+    assert not is_duplicate(worker_b, "signature")
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import shared_cache
+
+
+class SharedMemoryBackend(shared_cache.MemoryBackend):
+    # Stands in for Redis: load_json only stores values on a shared backend
+    shared = True
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = SharedMemoryBackend()
+    monkeypatch.setattr(shared_cache, "backend", backend)
+    return backend
+
+
+def test_version_is_stable_until_bumped(backend):
+    async def scenario():
+        first = await shared_cache.version("credentials:1")
+        again = await shared_cache.version("credentials:1")
+        await shared_cache.bump("credentials:1")
+        return first, again, await shared_cache.version("credentials:1")
+
+    first, again, bumped = asyncio.run(scenario())
+    assert first == again
+    assert bumped != first
+
+
+def test_fill_from_before_a_bump_is_not_read_back(backend):
+    async def scenario():
+        version = await shared_cache.version("credentials:1")
+
+        async def load_old_row():
+            # Another worker writes new tokens while this one is still reading the old row
+            await shared_cache.bump("credentials:1")
+            return ["old"]
+        await shared_cache.load_json(f"credentials:1:{version}", 60, load_old_row)
+
+        async def load_new_row():
+            return ["new"]
+        version = await shared_cache.version("credentials:1")
+        return await shared_cache.load_json(f"credentials:1:{version}", 60, load_new_row)
+
+    assert asyncio.run(scenario()) == ["new"]
+
+
+def test_ttl_can_depend_on_the_value(backend):
+    async def scenario():
+        async def load():
+            return {"ttl": 0}
+        await shared_cache.load_json("expired", lambda value: value["ttl"], load)
+        await shared_cache.load_json("live", 60, load)
+
+    asyncio.run(scenario())
+    assert backend._live("expired") is None
+    assert backend._live("live") is not None
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def fetch(value):
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return value * 2
+
+        waiters = [asyncio.create_task(flight.do("key", fetch, 21)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters)
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [42] * 5
+    assert stats == {"in_flight": 0, "executed": 1, "shared": 4}
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def echo(value):
+            await asyncio.sleep(0)
+            return value
+
+        return await asyncio.gather(flight.do("a", echo, 1), flight.do("b", echo, 2)), flight.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [1, 2]
+    assert stats["executed"] == 2
+
+
+def test_failure_reaches_every_caller_and_is_not_cached():
+    async def scenario():
+        flight = SingleFlight()
+        attempts = 0
+
+        async def flaky():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0)
+            if attempts == 1:
+                raise RuntimeError("boom")
+            return "ok"
+
+        first = await asyncio.gather(flight.do("key", flaky), flight.do("key", flaky), return_exceptions=True)
+        second = await flight.do("key", flaky)
+        return first, second, attempts
+
+    first, second, attempts = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in first)
+    assert second == "ok"
+    assert attempts == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "done"
+
+        cancelled = asyncio.create_task(flight.do("key", slow))
+        waiting = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        release.set()
+        return await waiting
+
+    assert asyncio.run(scenario()) == "done"
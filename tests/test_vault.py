@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+import vault
+from vault import Vault, VaultError
+
+
+@pytest.fixture
+def sealed_vault(monkeypatch, tmp_path):
+    monkeypatch.setattr(vault, "key_file", str(tmp_path / "vault.key"))
+    monkeypatch.setattr(vault, "create_missing_key", True)
+    monkeypatch.setattr(vault, "_vault", None)
+    return vault.get()
+
+
+def test_round_trip(sealed_vault):
+    sealed = vault.encrypt("swit-access-token", "user-1", "swit_token")
+    assert sealed.startswith(vault.prefix)
+    assert "swit-access-token" not in sealed
+    assert vault.decrypt(sealed, "user-1", "swit_token") == "swit-access-token"
+
+
+def test_ciphertext_is_bound_to_user_and_column(sealed_vault):
+    sealed = vault.encrypt("swit-access-token", "user-1", "swit_token")
+    with pytest.raises(VaultError):
+        vault.decrypt(sealed, "user-2", "swit_token")
+    with pytest.raises(VaultError):
+        vault.decrypt(sealed, "user-1", "asana_token")
+
+
+def test_tampered_ciphertext_is_rejected(sealed_vault):
+    sealed = vault.encrypt("swit-access-token", "user-1", "swit_token")
+    tampered = sealed[:-2] + ("AA" if sealed[-2:] != "AA" else "BB")
+    with pytest.raises(VaultError):
+        vault.decrypt(tampered, "user-1", "swit_token")
+
+
+def test_plaintext_and_empty_values_pass_through(sealed_vault):
+    assert vault.decrypt("legacy-plaintext-token", "user-1", "swit_token") == "legacy-plaintext-token"
+    assert vault.encrypt(None, "user-1", "swit_token") is None
+    assert vault.encrypt("", "user-1", "swit_token") == ""
+    assert vault.decrypt(None, "user-1", "swit_token") is None
+
+
+def test_data_key_rotates_after_max_uses(monkeypatch):
+    monkeypatch.setattr(vault, "data_key_max_uses", 2)
+    sealer = Vault(bytes(32))
+    values = [sealer.encrypt(f"token-{i}", "user-1:swit_token") for i in range(5)]
+    wrapped = [value[len(vault.prefix):].split(":", 1)[0] for value in values]
+    assert wrapped[0] == wrapped[1] != wrapped[2] == wrapped[3] != wrapped[4]
+    assert sealer.data_keys_created == 3
+    # Values sealed under earlier data keys still open, including on a fresh vault that has to unwrap them
+    reader = Vault(bytes(32))
+    assert [reader.decrypt(value, "user-1:swit_token") for value in values] == [f"token-{i}" for i in range(5)]
+    assert reader.data_keys_unwrapped == 3
+
+
+def test_missing_key_file_is_refused_when_creation_is_off(monkeypatch, tmp_path):
+    path = tmp_path / "vault.key"
+    monkeypatch.setattr(vault, "create_missing_key", False)
+    with pytest.raises(VaultError):
+        vault._load_master_key(str(path))
+    assert not path.exists()
+
+
+def test_production_defaults_to_refusing_a_missing_key(tmp_path):
+    # The default is read at import, so check it in a fresh interpreter
+    env = {key: value for key, value in os.environ.items() if key != "VAULT_CREATE_KEY"}
+    env.update(APP_ENV="production", VAULT_KEY_FILE=str(tmp_path / "vault.key"))
+    result = subprocess.run([sys.executable, "-c", "import vault; vault.get()"], cwd=os.path.dirname(vault.__file__),
+                            env=env, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "VaultError" in result.stderr
+    assert not (tmp_path / "vault.key").exists()
+
+
+def test_created_key_is_reused(monkeypatch, tmp_path):
+    path = str(tmp_path / "vault.key")
+    monkeypatch.setattr(vault, "create_missing_key", True)
+    key = vault._load_master_key(path)
+    assert vault._load_master_key(path) == key
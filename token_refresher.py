@@ -0,0 +1,93 @@
+import asyncio
+from time import time
+
+import logs
+
+
+class TokenRefresher:
+    def __init__(self, fetch_due, refreshers, record_failure, interval=60.0, horizon=300.0, batch_size=500,
+                 concurrency=8, leader=None):
+        # fetch_due(kind, deadline, after_id, limit) -> [(id, swit_id), ...] ordered by id: users whose `kind`
+        # token expires before deadline and whose refreshes have not been given up on
+        # refreshers: {"swit": async fn(user_id), "asana": async fn(user_id)}
+        # record_failure(kind, user_id): async, called when the token endpoint rejects a refresh
+        # leader: async fn() -> bool, so that with several workers only one of them scans per interval
+        self.fetch_due = fetch_due
+        self.refreshers = refreshers
+        self.record_failure = record_failure
+        self.interval = interval
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.leader = leader
+        self._task: asyncio.Task | None = None
+
+        self.scans = 0
+        self.skipped_scans = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    async def _refresh(self, semaphore, kind, user_id):
+        async with semaphore:
+            try:
+                result = await self.refreshers[kind](user_id)
+            except Exception as e:
+                # Outages and timeouts are retried on the next scan without counting against the user
+                logs.error("token_refresh.failed", kind=kind, user_id=user_id, error=str(e))
+                self.failed += 1
+                return
+            if result:
+                self.refreshed += 1
+                return
+            self.failed += 1
+            try:
+                await self.record_failure(kind, user_id)
+            except Exception as e:
+                logs.error("token_refresh.record_failure_failed", kind=kind, user_id=user_id, error=str(e))
+
+    async def run_once(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        deadline = int(time() + self.horizon)
+        for kind in self.refreshers:
+            after_id = 0
+            while True:
+                rows = await self.fetch_due(kind, deadline, after_id, self.batch_size)
+                if not rows:
+                    break
+                await asyncio.gather(*(self._refresh(semaphore, kind, user_id) for _, user_id in rows))
+                after_id = rows[-1][0]
+                if len(rows) < self.batch_size:
+                    break
+        self.scans += 1
+
+    async def _loop(self):
+        while True:
+            try:
+                if self.leader is None or await self.leader():
+                    await self.run_once()
+                else:
+                    self.skipped_scans += 1
+            except Exception as e:
+                logs.error("token_refresh.scan_failed", error=str(e))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "scans": self.scans,
+            "skipped_scans": self.skipped_scans,
+            "refreshed": self.refreshed,
+            "failed": self.failed
+        }
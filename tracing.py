@@ -0,0 +1,235 @@
+import os
+import queue
+import sys
+import threading
+from contextvars import ContextVar
+from random import getrandbits, random
+from time import time_ns
+
+import codec
+
+try:
+    from opentelemetry import propagate as otel_propagate, trace as otel_trace
+except ImportError:
+    otel_propagate = otel_trace = None
+
+# TRACE_EXPORTER: none | console (JSON lines on stderr) | file (JSON lines in TRACE_FILE) | otel (hand spans
+# to the OpenTelemetry SDK the process was started with, e.g. under opentelemetry-instrument)
+exporter_name = os.environ.get("TRACE_EXPORTER", "none").lower()
+trace_file = os.environ.get("TRACE_FILE", "traces.jsonl")
+sample_rate = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+export_queue_size = int(os.environ.get("TRACE_QUEUE_SIZE", "10000"))
+
+if exporter_name == "otel" and otel_trace is None:
+    raise RuntimeError("TRACE_EXPORTER=otel but the opentelemetry-api package is not installed")
+
+_current: ContextVar = ContextVar("trace_span", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, description):
+        pass
+
+
+_noop = _NoopSpan()
+
+
+class RemoteParent:
+    # The caller's span from an incoming traceparent header
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "attributes", "error", "start", "end",
+                 "_token")
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.span_id = f"{getrandbits(64):016x}"
+        if parent is None:
+            self.trace_id = f"{getrandbits(128):032x}"
+            self.parent_id = None
+            self.sampled = sample_rate >= 1.0 or random() < sample_rate
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.sampled = parent.sampled
+        self.attributes = attributes if attributes is not None else {}
+        self.error = None
+
+    def __enter__(self):
+        self.start = time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time_ns()
+        _current.reset(self._token)
+        if exc is not None and self.error is None:
+            self.error = repr(exc)
+        if self.sampled:
+            _exporter.export(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, description):
+        self.error = description
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        # Field names follow the OTLP JSON span encoding so the lines can be fed to collector tooling
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start,
+            "end_time_unix_nano": self.end,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"}
+        }
+
+
+class _OtelSpan:
+    # Adapts an OpenTelemetry span to the set_attribute / set_error interface used by callers
+    def __init__(self, name, attributes, parent):
+        self._manager = _otel_tracer.start_as_current_span(name, context=parent, attributes=attributes)
+
+    def __enter__(self):
+        self._span = self._manager.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._manager.__exit__(exc_type, exc, tb)
+
+    def set_attribute(self, key, value):
+        self._span.set_attribute(key, value)
+
+    def set_error(self, description):
+        self._span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, description))
+
+
+class _Exporter:
+    # Spans are serialized and written on a background thread so the request path never blocks on I/O
+    def __init__(self, open_stream):
+        self._open_stream = open_stream
+        self._queue = queue.Queue(maxsize=export_queue_size)
+        self._thread = None
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, span):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write, name="trace-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        stream = self._open_stream()
+        while True:
+            span = self._queue.get()
+            if span is None:
+                break
+            stream.write(codec.dumps(span.to_dict()).decode() + "\n")
+            self.exported += 1
+            if self._queue.empty():
+                stream.flush()
+        stream.flush()
+        if stream is not sys.stderr:
+            stream.close()
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def _create_exporter(name):
+    if name == "console":
+        return _Exporter(lambda: sys.stderr)
+    if name == "file":
+        return _Exporter(lambda: open(trace_file, "a", encoding="utf-8"))
+    if name in ("none", "otel"):
+        return None
+    raise ValueError(f"Unsupported TRACE_EXPORTER: {name}")
+
+
+_exporter = _create_exporter(exporter_name)
+_otel_tracer = otel_trace.get_tracer("asana_app") if exporter_name == "otel" else None
+
+
+def span(name, attributes=None, parent=None):
+    # Child of the current span (or of `parent`, from extract()); a shared no-op when tracing is off
+    if _otel_tracer is not None:
+        return _OtelSpan(name, attributes, parent)
+    if _exporter is None:
+        return _noop
+    return Span(name, attributes, parent if parent is not None else _current.get())
+
+
+def extract(headers):
+    # W3C trace context from an incoming request, or None
+    if _otel_tracer is not None:
+        return otel_propagate.extract(headers)
+    if _exporter is None:
+        return None
+    value = headers.get("traceparent")
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        sampled = bool(int(parts[3][:2], 16) & 1)
+    except ValueError:
+        return None
+    return RemoteParent(parts[1], parts[2], sampled)
+
+
+def inject(headers):
+    # Returns headers with traceparent set for the current span; the original object when there is none
+    if _otel_tracer is not None:
+        headers = dict(headers or {})
+        otel_propagate.inject(headers)
+        return headers
+    current = _current.get()
+    if current is None:
+        return headers
+    return {**(headers or {}), "traceparent": current.traceparent()}
+
+
+def shutdown():
+    if _exporter is not None:
+        _exporter.shutdown()
+
+
+def stats():
+    return {
+        "exporter": exporter_name,
+        "sample_rate": sample_rate,
+        "exported": _exporter.exported if _exporter is not None else None,
+        "dropped": _exporter.dropped if _exporter is not None else None
+    }
@@ -0,0 +1,168 @@
+import base64
+import os
+import threading
+from time import monotonic, perf_counter
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import logs
+from cache import TTLCache
+
+# Envelope encryption: each value is sealed with a data key, and the data key is stored next to it wrapped
+# by the master key from the local key file. Unwrapped data keys are cached, so a decrypt is one AES-GCM
+# open; callers decrypt once when filling the credential cache and never on a cache hit.
+key_file = os.environ.get("VAULT_KEY_FILE", "vault.key")
+# A missing key file is only created outside production. A new key there would leave every stored token
+# unreadable and give each host its own key, so production refuses to start instead.
+create_missing_key = os.environ.get("VAULT_CREATE_KEY", "0" if os.environ.get("APP_ENV") == "production" else "1") == "1"
+data_key_max_uses = int(os.environ.get("VAULT_DATA_KEY_MAX_USES", "100000"))
+data_key_max_age = float(os.environ.get("VAULT_DATA_KEY_MAX_AGE", "86400"))
+data_key_cache_size = int(os.environ.get("VAULT_DATA_KEY_CACHE_SIZE", "1000"))
+data_key_cache_ttl = float(os.environ.get("VAULT_DATA_KEY_CACHE_TTL", "3600"))
+
+prefix = "vault1:"
+_nonce_size = 12
+
+
+class VaultError(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _load_master_key(path) -> bytes:
+    # The key file holds 32 random bytes, base64 encoded; outside production it is created (mode 0600)
+    # on first start
+    try:
+        with open(path, "rb") as f:
+            key = base64.b64decode(f.read().strip())
+    except FileNotFoundError:
+        if not create_missing_key:
+            raise VaultError(f"Vault key file {os.path.abspath(path)} not found; set VAULT_KEY_FILE to the "
+                             "shared key, or VAULT_CREATE_KEY=1 to create a new one")
+        logs.warning("vault.key_created", path=os.path.abspath(path))
+        key = AESGCM.generate_key(bit_length=256)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # Another worker created it first
+            return _load_master_key(path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64encode(key) + b"\n")
+    if len(key) != 32:
+        raise VaultError(f"{path} must contain a base64 encoded 256-bit key")
+    return key
+
+
+class _DataKey:
+    __slots__ = ("aead", "wrapped", "uses", "created_at")
+
+    def __init__(self, aead, wrapped):
+        self.aead = aead
+        self.wrapped = wrapped
+        self.uses = 0
+        self.created_at = monotonic()
+
+
+class Vault:
+    def __init__(self, master_key: bytes):
+        self._master = AESGCM(master_key)
+        self._current: _DataKey | None = None
+        self._lock = threading.Lock()
+        self._data_keys = TTLCache(max_size=data_key_cache_size, default_ttl=data_key_cache_ttl)
+
+        self.encrypts = 0
+        self.decrypts = 0
+        self.data_keys_created = 0
+        self.data_keys_unwrapped = 0
+        self.decrypt_seconds = 0.0
+
+    def _data_key(self) -> _DataKey:
+        with self._lock:
+            current = self._current
+            if current is None or current.uses >= data_key_max_uses \
+                    or monotonic() - current.created_at > data_key_max_age:
+                key = AESGCM.generate_key(bit_length=256)
+                nonce = os.urandom(_nonce_size)
+                wrapped = _b64encode(nonce + self._master.encrypt(nonce, key, prefix.encode()))
+                current = self._current = _DataKey(AESGCM(key), wrapped)
+                self._data_keys.set(wrapped, current.aead)
+                self.data_keys_created += 1
+            current.uses += 1
+            return current
+
+    def _unwrap(self, wrapped: str) -> AESGCM:
+        aead = self._data_keys.get(wrapped)
+        if aead is None:
+            sealed = _b64decode(wrapped)
+            aead = AESGCM(self._master.decrypt(sealed[:_nonce_size], sealed[_nonce_size:], prefix.encode()))
+            self._data_keys.set(wrapped, aead)
+            self.data_keys_unwrapped += 1
+        return aead
+
+    def encrypt(self, value: str | None, context: str) -> str | None:
+        # context (e.g. "<swit_id>:swit_token") is bound as associated data, so a ciphertext copied
+        # to another user or column fails to decrypt
+        if not value:
+            return value
+        data_key = self._data_key()
+        nonce = os.urandom(_nonce_size)
+        sealed = data_key.aead.encrypt(nonce, value.encode(), context.encode())
+        self.encrypts += 1
+        return f"{prefix}{data_key.wrapped}:{_b64encode(nonce + sealed)}"
+
+    def decrypt(self, value: str | None, context: str) -> str | None:
+        # Values written before encryption was enabled pass through unchanged
+        if not value or not value.startswith(prefix):
+            return value
+        started = perf_counter()
+        try:
+            wrapped, sealed = value[len(prefix):].split(":", 1)
+            sealed = _b64decode(sealed)
+            plaintext = self._unwrap(wrapped).decrypt(sealed[:_nonce_size], sealed[_nonce_size:], context.encode())
+        except Exception as e:
+            raise VaultError(f"Could not decrypt {context.rsplit(':', 1)[-1]}") from e
+        self.decrypts += 1
+        self.decrypt_seconds += perf_counter() - started
+        return plaintext.decode()
+
+    def is_encrypted(self, value) -> bool:
+        return isinstance(value, str) and value.startswith(prefix)
+
+    def stats(self):
+        return {
+            "encrypts": self.encrypts,
+            "decrypts": self.decrypts,
+            "avg_decrypt_us": self.decrypt_seconds / self.decrypts * 1e6 if self.decrypts else 0.0,
+            "data_keys_created": self.data_keys_created,
+            "data_keys_unwrapped": self.data_keys_unwrapped,
+            "data_key_cache": self._data_keys.stats()
+        }
+
+
+_vault: Vault | None = None
+
+
+def get() -> Vault:
+    global _vault
+    if _vault is None:
+        _vault = Vault(_load_master_key(key_file))
+    return _vault
+
+
+def encrypt(value, swit_id, column):
+    return get().encrypt(value, f"{swit_id}:{column}")
+
+
+def decrypt(value, swit_id, column):
+    return get().decrypt(value, f"{swit_id}:{column}")
+
+
+def stats():
+    return get().stats() if _vault is not None else {}
@@ -0,0 +1,354 @@
+import os
+
+from templates import Slot, register
+
+swit_app_id = os.environ.get("SWIT_APP_ID")
+
+# Action ids of the create-task form fields, used to read the submitted values back
+task_name_action_id = "asana_task_name"
+task_description_action_id = "task_description"
+assignee_action_id = "asana_assignee"
+project_action_id = "asana_project"
+due_date_action_id = "a60389c6-2517-4388-8f56-da1aaf9c7b28"
+
+header_button = {
+    "type": "button",
+    "icon": {
+        "type": "image",
+        "image_url": "./assets/builder_logo.png",
+        "alt": "Header button icon"
+    },
+    "static_action": {
+        "action_type": "open_link",
+        "link_url": "https://swit.io"
+    }
+}
+
+oauth_view = register("oauth_view", {
+    "callback_type": "views.open",
+    "new_view": {
+        "view_id": "builder_test",
+        "state": Slot("state"),
+        "header": {
+            "title": "Connect to Asana",
+            "buttons": [header_button]
+        },
+        "body": {
+            "elements": [
+                {
+                    "type": "sign_in_page",
+                    "title": "Try Asana for Swit",
+                    "description": "Sign in to start using Asana in Swit.",
+                    "button": {
+                        "type": "button",
+                        "label": "Sign in",
+                        "action_id": "asana_oauth_button",
+                        "static_action": {
+                            "action_type": "open_oauth_popup",
+                            "link_url": Slot("oauth_url")
+                        }
+                    },
+                    "integrated_service": {
+                        "icon": {
+                            "type": "image",
+                            "image_url": "https://files.swit.io/data/assets/apps/23092108333670VJ6MRS/23103004371942AFKL5P.jpg"
+                        }
+                    }
+                }
+            ]
+        }
+    }
+})
+
+create_task_view = register("create_task_view", {
+    "callback_type": "views.open",
+    "new_view": {
+        "view_id": "asana_create_view",
+        "state": Slot("channel_id"),
+        "header": {
+            "title": "Create a new task",
+            "subtitle": "in Asana",
+            "buttons": [header_button]
+        },
+        "body": {
+            "elements": [
+                {
+                    "type": "text",
+                    "markdown": True,
+                    "content": "**Task name**"
+                },
+                {
+                    "type": "text_input",
+                    "action_id": task_name_action_id,
+                    "placeholder": "Write a task name",
+                    "trigger_on_input": False
+                },
+                {
+                    "type": "text",
+                    "markdown": True,
+                    "content": "**Task description**"
+                },
+                {
+                    "type": "textarea",
+                    "action_id": task_description_action_id,
+                    "placeholder": "Write a task description",
+                    "value": Slot("pre_filled_message"),
+                    "height": "small",
+                    "disabled": False
+                },
+                {
+                    "type": "text",
+                    "markdown": True,
+                    "content": "**Assignee**"
+                },
+                {
+                    "type": "select",
+                    "action_id": assignee_action_id,
+                    "options": Slot("assignee_options"),
+                    "placeholder": "Select an assignee",
+                    "multiselect": False,
+                    "trigger_on_input": False,
+                    "query": {
+                        "query_server": True,
+                        "disabled": False,
+                        "placeholder": "Search by member name",
+                        "value": None,
+                        "action_id": "asana_assignee_select"
+                    },
+                    "style": {
+                        "variant": "outlined"
+                    }
+                },
+                {
+                    "type": "text",
+                    "markdown": True,
+                    "content": "**Project**"
+                },
+                {
+                    "type": "select",
+                    "action_id": project_action_id,
+                    "placeholder": "Select a project",
+                    "multiselect": False,
+                    "trigger_on_input": False,
+                    "options": Slot("project_options"),
+                    "query": {
+                        "query_server": True,
+                        "disabled": False,
+                        "placeholder": "Search by project name",
+                        "value": None,
+                        "action_id": "asana_project_select"
+                    },
+                    "style": {
+                        "variant": "outlined"
+                    }
+                },
+                {
+                    "type": "text",
+                    "markdown": True,
+                    "content": "**Due date**"
+                },
+                {
+                    "type": "datepicker",
+                    "placeholder": "YYYY-MM-DD",
+                    "action_id": due_date_action_id
+                },
+                {
+                    "type": "button",
+                    "label": "Create",
+                    "action_id": "asana_create_button",
+                    "style": "primary_filled"
+                }
+            ]
+        }
+    }
+})
+
+new_task_view = register("new_task_view", {
+    "attachments": [
+        {
+            "body": {
+                "elements": [
+                    {
+                        "action_id": "sarahtest",
+                        "items": [
+                            {
+                                "label": "새로운 업무",
+                                "text": {
+                                    "content": "**새 업무에 첨부**",
+                                    "markdown": True,
+                                    "type": "text"
+                                }
+                            }
+                        ],
+                        "type": "info_card"
+                    }
+                ]
+            },
+            "header": {
+                "app_id": swit_app_id,
+                "title": "새로운 태스크를 생성하고, Attachment를 추가합니다."
+            },
+            "state": "test state"
+        }
+    ],
+    "destination_hint": {
+        "workspace_id": "24012409543257ODXSGR",
+        "project_id": "24012901343960R33NR9",
+        "task_id": "24020106575334Q2G9UD"
+    },
+    "callback_type": "attachments.share.new_task"
+})
+
+existing_task_view = register("existing_task_view", {
+    "attachments": [
+        {
+            "body": {
+                "elements": [
+                    {
+                        "action_id": "sarahtest",
+                        "items": [
+                            {
+                                "label": "기존 업무",
+                                "text": {
+                                    "content": "기존 업무에 첨부",
+                                    "style": {},
+                                    "type": "text"
+                                }
+                            }
+                        ],
+                        "type": "info_card"
+                    }
+                ]
+            },
+            "header": {
+                "app_id": swit_app_id,
+                "title": "기존 태스크에 Attachment를 추가합니다."
+            },
+            "state": "test state"
+        }
+    ],
+    "destination_hint": {
+        "workspace_id": "24012409543257ODXSGR",
+        "project_id": "24012901343960R33NR9",
+        "task_id": "24020106575334Q2G9UD"
+    },
+    "callback_type": "attachments.share.existing_task"
+})
+
+# Rich text of the help message, keyed by user language
+help_contents = {
+    "ko": register("help_content_ko", {
+        "type": "rich_text",
+        "elements": [
+            {
+                "type": "rt_section",
+                "elements": [
+                    {"type": "rt_mention", "user_id": Slot("user_id")},
+                    {"type": "rt_text", "content": " 안녕하세요. Swit에서 Asana앱을 사용하여 업무를 관리해 보세요.\n"},
+                    {"type": "rt_text", "content": "사용 가능한 커맨드", "styles": {"bold": True}}
+                ]
+            },
+            {
+                "type": "rt_blockquote",
+                "elements": [
+                    {"type": "rt_text", "content": "/asana_create", "styles": {"code": True}},
+                    {"type": "rt_text", "content": " 새 업무 생성.\n"},
+                    {"type": "rt_text", "content": "/asana_link", "styles": {"code": True}},
+                    {"type": "rt_text", "content": " 아사나 링크.\n"},
+                    {"type": "rt_text", "content": "/asana_settings", "styles": {"code": True}},
+                    {"type": "rt_text", "content": " 설정 보기.\n"},
+                    {"type": "rt_text", "content": "/asana_help", "styles": {"code": True}},
+                    {"type": "rt_text", "content": " 도움말."}
+                ]
+            },
+            {
+                "type": "rt_section",
+                "elements": [
+                    {"type": "rt_text", "content": "문의", "styles": {"bold": True}}
+                ]
+            },
+            {
+                "type": "rt_blockquote",
+                "elements": [
+                    {"type": "rt_link", "content": "문의 링크", "url": "https://help.swit.io/?support=true"}
+                ]
+            }
+        ]
+    }),
+    "en": register("help_content_en", {
+        "type": "rich_text",
+        "elements": [
+            {
+                "type": "rt_section",
+                "elements": [
+                    {"type": "rt_text", "content": "Hello "},
+                    {"type": "rt_mention", "user_id": Slot("user_id")},
+                    {"type": "rt_text",
+                     "content": ", here are some ways you can use Asana for Swit to manage your work.\n"},
+                    {"type": "rt_text", "content": "Available commands", "styles": {"bold": True}}
+                ]
+            },
+            {
+                "type": "rt_blockquote",
+                "elements": [
+                    {"type": "rt_text", "content": "Use "},
+                    {"type": "rt_text", "content": "/asana_create", "styles": {"code": True}},
+                    {"type": "rt_text",
+                     "content": " to create a new task. You can add text after the command to pre-fill the task name.\nUse "},
+                    {"type": "rt_text", "content": "/asana_link", "styles": {"code": True}},
+                    {"type": "rt_text",
+                     "content": " in a channel to manage the channel’s linked project notifications or to link a new project.\nUse "},
+                    {"type": "rt_text", "content": "/asana_settings", "styles": {"code": True}},
+                    {"type": "rt_text",
+                     "content": " to manage your personal notifications settings and default Asana domain.\nUse "},
+                    {"type": "rt_text", "content": "/asana_help", "styles": {"code": True}},
+                    {"type": "rt_text", "content": " to see this message again."}
+                ]
+            },
+            {
+                "type": "rt_section",
+                "elements": [
+                    {"type": "rt_text", "content": "Support", "styles": {"bold": True}}
+                ]
+            },
+            {
+                "type": "rt_blockquote",
+                "elements": [
+                    {"type": "rt_link", "content": "Contact us", "url": "https://help.swit.io/?support=true"},
+                    {"type": "rt_text", "content": "."}
+                ]
+            }
+        ]
+    })
+}
+
+message_body = register("message_body", {
+    "channel_id": Slot("channel_id"),
+    "content": Slot("content"),
+    "body_type": "json_string"
+})
+
+# Shown right away while Asana, Swit or the database is unreachable
+unavailable_view = register("unavailable_view", {
+    "callback_type": "views.open",
+    "new_view": {
+        "view_id": "asana_unavailable_view",
+        "header": {
+            "title": "Asana is unavailable",
+            "buttons": [header_button]
+        },
+        "body": {
+            "elements": [
+                {
+                    "type": "text",
+                    "markdown": True,
+                    "content": "The service is not responding right now. Please try again in a minute."
+                }
+            ]
+        }
+    }
+})
+
+close_view = register("close_view", {
+    "callback_type": "views.close"
+})